@@ -0,0 +1,434 @@
+""" Local stand-in for the Calamari, Jira and Tempo APIs with a synthetic organisation
+
+Usage: python benchmarks/fakeserver.py [--employees 500] [--port 8080] [--latency 0.05] [--rate-limit-ratio 0.01]
+
+All three APIs are served by a single HTTP server under different prefixes:
+{url}/calamari (CALAMARI_API_URL), {url}/jira (JIRA_API_URL) and {url}/tempo/4 (TEMPO_API_URL).
+"""
+import argparse
+import collections
+import datetime as dt
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WEEKDAYS = ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY")
+ABSENCE_ISSUE = {"id": "10000", "key": "LEAVE-1"}
+CONTRACT_TYPES = ("Employment", "B2B")
+TEAM_SIZE = 10
+ISSUES_PER_TEAM = 5
+
+
+class Organisation:
+    """ Deterministic synthetic data of an organisation """
+
+    def __init__(self, employees: int, seed: int = 0, days_before: int = 30, days_after: int = 30):
+        rng = random.Random(seed)
+        today = dt.date.today()
+        self.period = (today - dt.timedelta(days=days_before), today + dt.timedelta(days=days_after))
+
+        self.workweeks = [
+            {"id": 1, "workingDays": [{"dayName": day, "duration": 8 * 3600 if i < 5 else None} for i, day in enumerate(WEEKDAYS)]},
+            {"id": 2, "workingDays": [{"dayName": day, "duration": 4 * 3600 if i < 5 else None} for i, day in enumerate(WEEKDAYS)]},
+        ]
+        self.holidays = {1: [today.replace(month=1, day=1).isoformat()], 2: [today.replace(month=5, day=3).isoformat()]}
+
+        self.employees = []
+        self.users = []
+        for i in range(employees):
+            email = f"employee{i}@example.com"
+            self.employees.append({
+                "email": email,
+                "contractType": {"name": CONTRACT_TYPES[i % 4 == 3]},
+                "workingWeek": {"id": 1 if i % 5 else 2},
+                "holidayCalendar": {"id": 1 + i % 2},
+            })
+            # a few employees have no Jira account
+            if i % 100 != 99:
+                self.users.append({"accountId": f"557058:{i:08d}", "emailAddress": email, "accountType": "atlassian", "active": True})
+
+        self.accounts = {user["emailAddress"]: user["accountId"] for user in self.users}
+        self.emails = {account: email for email, account in self.accounts.items()}
+
+        # worklogs on past working days, teams share a few issues
+        self.worklogs = []
+        self.timesheets = []
+        days = [self.period[0] + dt.timedelta(days=n) for n in range((today - self.period[0]).days + 1)]
+        for i, employee in enumerate(self.employees):
+            account = self.accounts.get(employee["email"])
+            team_issue = 20000 + (i // TEAM_SIZE) * ISSUES_PER_TEAM
+            for day in days:
+                if day.weekday() >= 5:
+                    continue
+                seconds = 0
+                for _ in range(rng.randint(1, 3)):
+                    spent = rng.choice((1800, 3600, 7200))
+                    seconds += spent
+                    if account is not None:
+                        self.worklogs.append({
+                            "id": len(self.worklogs) + 1,
+                            "issueId": team_issue + rng.randrange(ISSUES_PER_TEAM),
+                            "accountId": account,
+                            "started": day.isoformat(),
+                            "seconds": spent,
+                        })
+                # most timesheets are already in sync, some are stale or missing
+                roll = rng.random()
+                if roll < 0.8:
+                    self.add_timesheet(employee["email"], day.isoformat(), seconds)
+                elif roll < 0.9:
+                    self.add_timesheet(employee["email"], day.isoformat(), seconds + 1800)
+
+        self.absences = collections.defaultdict(list)
+        self.absence_worklogs = []
+        for i, employee in enumerate(self.employees):
+            if i % 10 != 0:
+                continue
+            start = self.period[0] + dt.timedelta(days=rng.randrange(days_before + days_after))
+            length = rng.randint(1, 5)
+            self.absences[employee["email"]].append({
+                "id": i,
+                "employee": {"email": employee["email"]},
+                "from": start.isoformat(),
+                "to": (start + dt.timedelta(days=length - 1)).isoformat(),
+                "absenceTypeName": "Remote" if i % 30 == 0 else "Vacation",
+                "fullDayRequest": True,
+                "entitlementAmountUnit": "DAYS",
+                "entitlementAmount": length,
+                "amountFirstDay": None,
+                "amountLastDay": None,
+            })
+            # half of the absences are already logged in Tempo
+            account = self.accounts.get(employee["email"])
+            if i % 20 == 0 and account is not None and start.weekday() < 5:
+                self.absence_worklogs.append({"accountId": account, "startDate": start.isoformat(), "seconds": 8 * 3600})
+
+    def add_timesheet(self, email: str, day: str, seconds: int) -> dict:
+        entry = {"id": len(self.timesheets) + 1, "person": {"email": email}, "started": f"{day}T08:00:00", "duration": seconds}
+        self.timesheets.append(entry)
+        return entry
+
+
+class FakeApi:
+    """ Request router of the fake APIs, with injected latency and 429 responses """
+
+    def __init__(self, organisation: Organisation, latency: float = 0.0, page_size: int = 50, rate_limit_ratio: float = 0.0, seed: int = 0):
+        self.org = organisation
+        self.latency = latency
+        self.page_size = page_size
+        self.rate_limit_ratio = rate_limit_ratio
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.base_url = None
+
+        self.worklogs_by_issue = collections.defaultdict(list)
+        self.worklogs_by_account = collections.defaultdict(list)
+        for worklog in organisation.worklogs:
+            self.worklogs_by_issue[worklog["issueId"]].append(worklog)
+            self.worklogs_by_account[worklog["accountId"]].append(worklog)
+        self.timesheets_by_id = {entry["id"]: entry for entry in organisation.timesheets}
+
+        # (method, path pattern, endpoint name, handler)
+        self.routes = [
+            ("POST", r"/calamari/api/employees/v1/list", "calamari employees/v1/list", self.employees),
+            ("POST", r"/calamari/api/working-week/v1/all", "calamari working-week/v1/all", lambda m, q, b: self.org.workweeks),
+            ("POST", r"/calamari/api/leave/request/v1/find-advanced", "calamari leave/request/v1/find-advanced", self.absences),
+            ("POST", r"/calamari/api/holiday/v1/find", "calamari holiday/v1/find", self.holidays),
+            *(
+                ("POST", rf"/calamari/api/clockin/timesheetentries/v1/({action})", f"calamari clockin/timesheetentries/v1/{action}", self.timesheets)
+                for action in ("find", "create", "update", "delete")
+            ),
+            ("GET", r"/jira/rest/api/3/users/search", "jira users/search", self.users),
+            ("GET", r"/jira/rest/api/3/user/search", "jira user/search", self.user_search),
+            ("GET", r"/jira/rest/api/3/user", "jira user", lambda m, q, b: self.user_by_account(q["accountId"])),
+            ("POST", r"/jira/rest/api/3/search/jql", "jira search/jql", self.search),
+            ("GET", r"/jira/rest/api/3/issue/(\d+)/worklog", "jira issue/{id}/worklog", self.issue_worklogs),
+            ("GET", r"/jira/rest/api/3/issue/([^/]+)", "jira issue/{key}", self.issue),
+            ("GET", r"/tempo/4/worklogs/issue/(\d+)", "tempo worklogs/issue/{id}", self.tempo_issue_worklogs),
+            ("GET", r"/tempo/4/worklogs/user/([^/]+)", "tempo worklogs/user/{accountId}", self.tempo_user_worklogs),
+            ("POST", r"/tempo/4/worklogs/search", "tempo worklogs/search", self.tempo_search_worklogs),
+            ("POST", r"/tempo/4/worklogs/issue/(\d+)/bulk", "tempo worklogs/issue/{id}/bulk", self.tempo_create_worklogs),
+            ("POST", r"/tempo/4/worklogs", "tempo worklogs", self.tempo_create_worklog),
+        ]
+
+    def handle(self, method: str, url: str, body) -> tuple:
+        """ Return (status, headers, JSON response) of a request """
+
+        parsed = urllib.parse.urlsplit(url)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        for route_method, pattern, name, handler in self.routes:
+            match = re.fullmatch(pattern, parsed.path)
+            if route_method != method or match is None:
+                continue
+
+            endpoint = f"{method} {name}"
+            if self.latency:
+                time.sleep(self.latency)
+            with self.lock:
+                self.calls[endpoint] += 1
+                throttle = self.rng.random() < self.rate_limit_ratio
+                if throttle:
+                    self.throttled[endpoint] += 1
+            if throttle:
+                return 429, {"Retry-After": "0"}, {"message": "Rate limit exceeded"}
+            return 200, {}, handler(method, query, body, *match.groups())
+
+        return 404, {}, {"message": f"No route for {method} {parsed.path}"}
+
+    def page(self, items: list, offset: int, limit: int) -> tuple:
+        limit = min(limit, self.page_size)
+        return items[offset:offset + limit], offset + limit < len(items)
+
+    # Calamari
+
+    def employees(self, method, query, body):
+        page = body.get("page", 0)
+        pages = max((len(self.org.employees) + self.page_size - 1) // self.page_size, 1)
+        return {
+            "employees": self.org.employees[page * self.page_size:(page + 1) * self.page_size],
+            "currentPage": page,
+            # the last page number, as read by the client
+            "totalPages": pages - 1,
+        }
+
+    def absences(self, method, query, body):
+        return [absence for email in body["employees"] for absence in self.org.absences.get(email, [])]
+
+    def holidays(self, method, query, body):
+        employee = next((e for e in self.org.employees if e["email"] == body["employee"]), None)
+        calendar = employee["holidayCalendar"]["id"] if employee else 1
+        return [
+            {"start": day, "end": day, "name": "Holiday"}
+            for day in self.org.holidays[calendar] if body["from"] <= day <= body["to"]
+        ]
+
+    def timesheets(self, method, query, body, action):
+        with self.lock:
+            if action == "find":
+                emails = set(body["employees"])
+                return [
+                    entry for entry in self.org.timesheets
+                    if entry["person"]["email"] in emails and body["from"] <= entry["started"][:10] <= body["to"]
+                ]
+            if action == "create":
+                entry = self.org.add_timesheet(body["person"], body["shiftStart"][:10], _shift_seconds(body))
+                self.timesheets_by_id[entry["id"]] = entry
+                return entry
+            if action == "update":
+                entry = self.timesheets_by_id[body["id"]]
+                entry["started"] = body["shiftStart"]
+                entry["duration"] = _shift_seconds(body)
+                return entry
+            entry = self.timesheets_by_id.pop(body["id"], None)
+            if entry is not None:
+                self.org.timesheets.remove(entry)
+            return {}
+
+    # Jira
+
+    def users(self, method, query, body):
+        items, _ = self.page(self.org.users, int(query.get("startAt", 0)), int(query.get("maxResults", 50)))
+        return items
+
+    def user_search(self, method, query, body):
+        return [user for user in self.org.users if user["emailAddress"] == query.get("query")]
+
+    def user_by_account(self, account_id):
+        return next(user for user in self.org.users if user["accountId"] == account_id)
+
+    def search(self, method, query, body):
+        jql = body["jql"]
+        account = re.search(r"worklogAuthor = (\S+)", jql).group(1)
+        date_from = re.search(r"worklogDate >= (\S+)", jql).group(1)
+        date_to = re.search(r"worklogDate <= (\S+)", jql).group(1)
+        issue_ids = sorted({
+            worklog["issueId"] for worklog in self.worklogs_by_account[account]
+            if date_from <= worklog["started"] <= date_to
+        })
+
+        start = int(body.get("nextPageToken") or 0)
+        chunk, more = self.page(issue_ids, start, body.get("maxResults", 50))
+        issues = []
+        for issue_id in chunk:
+            worklogs = [_jira_worklog(w) for w in self.worklogs_by_issue[issue_id]]
+            issues.append({
+                "id": str(issue_id),
+                "key": f"PRJ-{issue_id}",
+                "fields": {"worklog": {"startAt": 0, "maxResults": 20, "total": len(worklogs), "worklogs": worklogs[:20]}},
+            })
+
+        result = {"issues": issues, "isLast": not more}
+        if more:
+            result["nextPageToken"] = str(start + len(chunk))
+        return result
+
+    def issue_worklogs(self, method, query, body, issue_id):
+        worklogs = [_jira_worklog(w) for w in self.worklogs_by_issue[int(issue_id)]]
+        start = int(query.get("startAt", 0))
+        items = worklogs[start:start + int(query.get("maxResults", 5000))]
+        return {"startAt": start, "maxResults": len(items), "total": len(worklogs), "worklogs": items}
+
+    def issue(self, method, query, body, key):
+        if key in (ABSENCE_ISSUE["id"], ABSENCE_ISSUE["key"]):
+            return ABSENCE_ISSUE
+        issue_id = int(key.split("-")[-1])
+        return {"id": str(issue_id), "key": f"PRJ-{issue_id}"}
+
+    # Tempo
+
+    def tempo_page(self, path: str, query: dict, items: list) -> dict:
+        offset = int(query.get("offset", 0))
+        results, more = self.page(items, offset, int(query.get("limit", 50)))
+        metadata = {"count": len(results), "offset": offset}
+        if more:
+            metadata["next"] = f"{self.base_url}{path}?" + urllib.parse.urlencode({**query, "offset": offset + len(results)})
+        return {"results": results, "metadata": metadata}
+
+    def tempo_issue_worklogs(self, method, query, body, issue_id):
+        with self.lock:
+            items = [
+                {"author": {"accountId": w["accountId"]}, "startDate": w["startDate"], "timeSpentSeconds": w["seconds"], "issue": {"id": int(issue_id), "self": f"{self.base_url}/jira/rest/api/3/issue/{issue_id}"}}
+                for w in self.org.absence_worklogs if query["from"] <= w["startDate"] <= query["to"]
+            ]
+        return self.tempo_page(f"/tempo/4/worklogs/issue/{issue_id}", query, items)
+
+    def tempo_user_worklogs(self, method, query, body, account_id):
+        items = [
+            {
+                "author": {"accountId": w["accountId"]},
+                "startDate": w["started"],
+                "timeSpentSeconds": w["seconds"],
+                "issue": {"id": w["issueId"], "self": f"{self.base_url}/jira/rest/api/3/issue/{w['issueId']}"},
+            }
+            for w in self.worklogs_by_account[account_id] if query["from"] <= w["started"] <= query["to"]
+        ]
+        return self.tempo_page(f"/tempo/4/worklogs/user/{account_id}", query, items)
+
+    def tempo_search_worklogs(self, method, query, body):
+        authors = set(body["authorIds"])
+        items = [
+            {
+                "author": {"accountId": w["accountId"]},
+                "startDate": w["started"],
+                "timeSpentSeconds": w["seconds"],
+                "issue": {"id": w["issueId"], "self": f"{self.base_url}/jira/rest/api/3/issue/{w['issueId']}"},
+            }
+            for account_id in sorted(authors) for w in self.worklogs_by_account[account_id]
+            if body["from"] <= w["started"] <= body["to"]
+        ]
+        absence_id = int(ABSENCE_ISSUE["id"])
+        with self.lock:
+            items += [
+                {"author": {"accountId": w["accountId"]}, "startDate": w["startDate"], "timeSpentSeconds": w["seconds"], "issue": {"id": absence_id, "self": f"{self.base_url}/jira/rest/api/3/issue/{absence_id}"}}
+                for w in self.org.absence_worklogs if w["accountId"] in authors and body["from"] <= w["startDate"] <= body["to"]
+            ]
+        return self.tempo_page("/tempo/4/worklogs/search", query, items)
+
+    def tempo_create_worklog(self, method, query, body):
+        with self.lock:
+            self.org.absence_worklogs.append({"accountId": body["authorAccountId"], "startDate": body["startDate"], "seconds": body["timeSpentSeconds"]})
+        return body
+
+    def tempo_create_worklogs(self, method, query, body, issue_id):
+        return [self.tempo_create_worklog(method, query, {**worklog, "issueId": int(issue_id)}) for worklog in body]
+
+
+def _shift_seconds(body: dict) -> float:
+    return (dt.datetime.fromisoformat(body["shiftEnd"]) - dt.datetime.fromisoformat(body["shiftStart"])).total_seconds()
+
+
+def _jira_worklog(worklog: dict) -> dict:
+    return {
+        "id": str(worklog["id"]),
+        "author": {"accountId": worklog["accountId"]},
+        "started": f"{worklog['started']}T09:00:00.000+0000",
+        "updated": f"{worklog['started']}T18:00:00.000+0000",
+        "timeSpentSeconds": worklog["seconds"],
+    }
+
+
+def serve(api: FakeApi, port: int = 0) -> ThreadingHTTPServer:
+    """ Start the fake APIs in a background thread, the base URL is set on api """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.respond()
+
+        def do_POST(self):
+            self.respond()
+
+        def respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            status, headers, data = api.handle(self.command, self.path, body)
+            payload = json.dumps(data).encode()
+            if status == 200:
+                # every response can be revalidated, like behind a caching proxy
+                headers = {**headers, "ETag": f'"{hashlib.sha1(payload).hexdigest()}"'}
+                if self.headers.get("If-None-Match") == headers["ETag"]:
+                    # RFC 7232: a matching precondition fails requests other than GET and HEAD
+                    status, payload = (304 if self.command in ("GET", "HEAD") else 412), b""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    api.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def environment(api: FakeApi) -> dict:
+    """ Return settings pointing the integration to the fake APIs """
+
+    return {
+        "CALAMARI_API_URL": f"{api.base_url}/calamari",
+        "CALAMARI_API_TOKEN": "fake",
+        "CALAMARI_TIMESHEET_CONTRACT_TYPES": CONTRACT_TYPES[0],
+        "CALAMARI_ABSENCE_IGNORED_TYPES": "Remote",
+        "JIRA_API_URL": f"{api.base_url}/jira",
+        "JIRA_API_USER": "fake@example.com",
+        "JIRA_API_TOKEN": "fake",
+        "JIRA_ABSENCE_ISSUE": ABSENCE_ISSUE["key"],
+        "TEMPO_API_URL": f"{api.base_url}/tempo/4",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    api = FakeApi(Organisation(args.employees), args.latency, args.page_size, args.rate_limit_ratio)
+    server = serve(api, args.port)
+    for key, value in environment(api).items():
+        print(f"export {key}={value!r}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
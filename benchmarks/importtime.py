@@ -0,0 +1,68 @@
+""" Measure import time of the Lambda handler with `python -X importtime`
+
+Usage: python benchmarks/importtime.py [--module src.main] [--top 15] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str) -> list:
+    """ Import module in a fresh interpreter, return (self us, cumulative us, name) per imported module """
+
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    result = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        result.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return result
+
+
+def direct_imports(run: list) -> list:
+    """ Return modules imported directly by the measured module, slowest first """
+
+    # nested imports are printed before their parent and indented by two
+    # spaces per level, the measured module is the last top-level entry
+    result = []
+    for entry in reversed(run[:-1]):
+        depth = (len(entry[2]) - len(entry[2].lstrip())) // 2
+        if depth == 0:
+            break
+        if depth == 1:
+            result.append(entry)
+    return sorted(result, key=lambda r: -r[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="src.main", help="module to import")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest direct imports to show")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to average over")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    # the imported module itself is the last (outermost) entry
+    totals = [run[-1][1] for run in runs]
+    print(f"import {args.module}: median {statistics.median(totals) / 1000:.1f} ms "
+          f"(min {min(totals) / 1000:.1f} ms, max {max(totals) / 1000:.1f} ms, {args.runs} runs)")
+
+    print(f"\n{'cumulative [ms]':>16}  {'self [ms]':>10}  module")
+    for self_us, cumulative_us, name in direct_imports(runs[-1])[:args.top]:
+        print(f"{cumulative_us / 1000:>16.1f}  {self_us / 1000:>10.1f}  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
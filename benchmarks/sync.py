@@ -0,0 +1,105 @@
+""" Benchmark the synchronization jobs against the local fake APIs
+
+Usage: python benchmarks/sync.py [--employees 50 500 5000] [--jobs sync-absences sync-timesheets] [--latency 0.02]
+
+Every job runs in a fresh interpreter (like a cold Lambda) against a fresh
+synthetic organisation, the report shows wall time and API calls per endpoint.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeserver
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNER = "import json, sys; from src.main import lambda_handler; lambda_handler(json.loads(sys.argv[1]), None)"
+
+
+def run(employees: int, job: str, args) -> dict:
+    """ Run a job against a fresh organisation, return wall time and call counts """
+
+    api = fakeserver.FakeApi(
+        fakeserver.Organisation(employees, days_before=args.days_before, days_after=args.days_after),
+        latency=args.latency,
+        page_size=args.page_size,
+        rate_limit_ratio=args.rate_limit_ratio,
+    )
+    server = fakeserver.serve(api)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = {
+                **os.environ,
+                **fakeserver.environment(api),
+                "CACHE_DIR": cache_dir,
+                "DAYS_BEFORE": str(args.days_before),
+                "DAYS_AFTER": str(args.days_after),
+                # client side rate limits would dominate the measurement
+                "JIRA_RATE_LIMIT": "0",
+                "TEMPO_RATE_LIMIT": "0",
+                "CALAMARI_RATE_LIMIT": "0",
+                **dict(item.split("=", 1) for item in args.env),
+            }
+            if args.tempo:
+                env["TEMPO_API_TOKEN"] = "fake"
+
+            started = time.perf_counter()
+            res = subprocess.run(
+                [sys.executable, "-c", RUNNER, json.dumps({"job": job})],
+                cwd=ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if res.returncode != 0:
+        sys.stderr.write(res.stderr)
+        raise SystemExit(f"{job} failed for {employees} employees")
+
+    return {
+        "employees": employees,
+        "job": job,
+        "seconds": round(elapsed, 3),
+        "calls": sum(api.calls.values()),
+        "throttled": sum(api.throttled.values()),
+        "endpoints": dict(api.calls.most_common()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--jobs", nargs="+", default=["sync-absences", "sync-timesheets"])
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--days-before", type=int, default=30)
+    parser.add_argument("--days-after", type=int, default=30)
+    parser.add_argument("--tempo", action="store_true", help="synchronize timesheets from Tempo instead of Jira worklogs")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra settings, e.g. SYNC_WORKERS=16")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    args = parser.parse_args()
+
+    for employees in args.employees:
+        for job in args.jobs:
+            result = run(employees, job, args)
+            if args.json:
+                print(json.dumps(result), flush=True)
+                continue
+
+            print(f"{job} / {employees} employees: {result['seconds']:.2f}s, {result['calls']} calls, {result['throttled']} throttled")
+            for endpoint, count in result["endpoints"].items():
+                print(f"  {count:7d}  {endpoint}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,203 +1,375 @@
 import logging
+from dataclasses import dataclass
 
-import src.utils.aws as aws
 import src.utils.calamari as calamari
+import src.utils.directory as directory
 import src.utils.jira as jira
+import src.utils.metrics as metrics
+import src.utils.planner as planner
+import src.utils.reconcile as reconcile
 import src.utils.settings as settings
+import src.utils.sharding as sharding
+import src.utils.state as state
+import src.utils.writer as writer
+from src.utils.concurrency import run_parallel
 from src.utils.date import get_month_range_yesterday
 from src.utils.date import get_dates_range
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 
-def sync_absences():
-    ignored_employees = settings.get("calamari_absence_ignored_employees").split(",")
-    absence_issue_id = jira.get_jira_issue_id(settings.get("jira_absence_issue"))
-    workweeks = calamari.get_workweeks()
 
-    conflicts = {}
-    for employee in calamari.get_employees():
-        period_start, period_end = get_dates_range()
-        employee_email = employee["email"]
-        employee_workweek_id = employee['workingWeek']['id']
-        
-        if not jira.user_exists(employee_email):
-                logging.warning("User %s does not exist in jira. Skipping.", employee_email)
-                continue
-        
-        if employee_email in ignored_employees:
-            logging.debug("Ignoring absences of %s - employee ignored by configuration", employee_email)
-            if employee_email in absence_worklogs:
-                conflicts[employee_email] = absence_worklogs[employee_email]
-            continue
-        workweek=calamari.get_workweek(workweeks, employee_workweek_id)
-        approved_absences = calamari.get_approved_absences(employee_email)
-        logging.debug("Approved absences: %s", approved_absences)
-
-        # absence can span before or after synchronization period
-        for absence in approved_absences:
-     
-            absence_start = datetime.strptime(absence["from"], "%Y-%m-%d")
-            absence_end = datetime.strptime(absence["to"], "%Y-%m-%d")
-            if absence_start < period_start:
-                logging.debug("Absence date %s is < period_start (%s)", absence_start, period_start.strftime("%Y-%m-%d"))
-                period_start = absence_start
-            if absence_end > period_end:
-                logging.debug("Absence date %s is > period_end (%s)", absence_end, period_start.strftime("%Y-%m-%d"))
-                period_end = absence_end
-                
-        logging.debug("Fetching worklogs for %s - %s", period_start.strftime("%Y-%m-%d"), period_end.strftime("%Y-%m-%d"))
-        absence_worklogs = jira.fetch_tempo_absences(period_start, period_end)
-
-        employee_absences = calamari.filter_absences(
-            employee_email,
-            approved_absences,
-            workweek,
-            period_start,
-            period_end
-        )
+@dataclass(frozen=True)
+class RunContext:
+    """ Data shared by the jobs of a single invocation, fetched once """
+
+    employees: tuple
+    workweeks: list|None = None
+    absence_issue_id: str|None = None
+    # (shard, number of shards) when only a part of employees is synchronized
+    shard: tuple|None = None
+
+
+def build_context(absences: bool = True, shard: tuple|None = None) -> RunContext:
+    """ Fetch the shared data concurrently, workweeks and absence issue only when absences are synchronized """
+
+    # the Jira user directory is loaded alongside, account lookups of the jobs then hit its cache
+    reads = [calamari.get_employees, directory.get_directory]
+    if absences:
+        reads += [calamari.get_workweeks, lambda: jira.get_jira_issue_id(settings.get("jira_absence_issue"))]
+    with metrics.phase("context"):
+        employees, _, *shared = run_parallel(lambda read: read(), reads)
+
+    if shard is not None:
+        employees = sharding.select(employees, *shard)
+        logging.info("Synchronizing shard %s/%s: %d employees", shard[0], shard[1], len(employees))
+    return RunContext(employees, *shared, shard=shard)
+
+
+def sync_all(context: RunContext|None = None, shard: tuple|None = None) -> dict:
+    """ Synchronize absences, then timesheets, so timesheets see the absence worklogs just created """
 
-        logging.debug("COMPARE Employee absences: %s", employee_absences)
-        logging.debug("COMPARE Absence worklogs: %s", absence_worklogs)
-        if employee_absences == absence_worklogs[employee_email]:
-            logging.info("No conflicts for user %s", employee_email)
+    if context is None:
+        context = build_context(shard=shard)
+    conflicts = sync_absences(context)
+    sync_timesheets(context)
+    return conflicts
+
+
+def sync_absences(context: RunContext|None = None, shard: tuple|None = None) -> dict:
+    """ Create missing absence worklogs, return conflicting worklogs by employee email """
+
+    if context is None:
+        context = build_context(shard=shard)
+    ignored_employees = settings.load().calamari_absence_ignored_employees
+    absence_issue_id = context.absence_issue_id
+    workweeks = context.workweeks
+    employees = context.employees
+    with metrics.phase("absences:users"):
+        in_jira = run_parallel(lambda employee: jira.user_exists(employee.email), employees)
+
+    ignored = []
+    synchronized = []
+    for employee, exists in zip(employees, in_jira):
+        if not exists:
+            logging.warning("User %s does not exist in jira. Skipping.", employee.email)
+            continue
+        if employee.email in ignored_employees:
+            logging.debug("Ignoring absences of %s - employee ignored by configuration", employee.email)
+            period_start, period_end = get_dates_range()
+            ignored.append((employee.email, period_start, period_end))
             continue
+        synchronized.append(employee)
 
-        logging.debug("%s %s", employee_email, employee_absences)
-        for absence in employee_absences:
+    # collect synchronization periods of all employees first, so the absence
+    # worklogs can be fetched from Tempo once for the whole run
+    with metrics.phase("absences:calamari"):
+        approved_absences = calamari.get_approved_absences_batch([employee.email for employee in synchronized])
+        pending = [
+            _prepare_employee_absences(employee, workweeks, approved_absences[employee.email])
+            for employee in synchronized
+        ]
 
-            if absence in absence_worklogs[employee_email]:
-                logging.debug("Worklog for absence of %s exists on %s", employee_email, absence["date"])
-                absence_worklogs[employee_email].remove(absence)
-                continue
-            
+    periods = [(p[-2], p[-1]) for p in pending] + [(p[-2], p[-1]) for p in ignored]
+    if not periods:
+        logging.info("No employees to synchronize absences for.")
+        return {}
+    run_start = min(p[0] for p in periods)
+    run_end = max(p[1] for p in periods)
+    logging.debug("Fetching worklogs for %s - %s", run_start.strftime("%Y-%m-%d"), run_end.strftime("%Y-%m-%d"))
+    with metrics.phase("absences:tempo"):
+        absence_index = jira.index_tempo_absences(jira.fetch_tempo_absences(run_start, run_end))
 
-            logging.info("Worklog for absence of %s is missing on %s (%s hours)", employee_email, absence["date"], absence["amount"])
-            jira_account_id = jira.get_account_id(employee_email)
-            jira.create_tempo_absence_worklog(absence_issue_id, absence["amount"]*3600, absence["date"], jira_account_id)
+    conflicts = {}
+    for employee_email, period_start, period_end in ignored:
+        employee_worklogs = jira.slice_tempo_absences(absence_index, employee_email, period_start, period_end)
+        if len(employee_worklogs) > 0:
+            conflicts[employee_email] = employee_worklogs
+
+    def sync_employee(p):
+        with metrics.employee(p[0]):
+            return _sync_employee_absences(absence_index, *p)
+
+    with metrics.phase("absences:employees"):
+        results = run_parallel(sync_employee, pending)
+    for (employee_email, *_), (employee_conflicts, _) in zip(pending, results):
+        if len(employee_conflicts) > 0:
+            conflicts[employee_email] = employee_conflicts
+
+    # missing worklogs of all employees are created as one batch
+    with metrics.phase("absences:create"):
+        failures = writer.create_absence_worklogs(absence_issue_id, [worklog for _, missing in results for worklog in missing], absence_index)
+    # absence worklogs which could not be created are reported along with the conflicts
+    for failure in failures:
+        conflicts.setdefault(failure.worklog.employee, []).append({**failure.worklog.as_conflict(), "error": failure.error})
 
-        if len(absence_worklogs[employee_email]) > 0:
-            conflicts[employee_email] = absence_worklogs[employee_email]
     if len(conflicts) == 0:
         logging.info("No conflicts in worklogs detected. Well done!")
     else:
         logging.warning("Conflicting worklogs detected: %s",conflicts)
-    # msg = _prepare_conflicts_message(conflicts)
-    # print(msg)
-    #aws.send_email("Absence sync report", msg, settings.get("notification_emails").split(","))
-
-
-# def _prepare_conflicts_message(conflicts: dict) -> str:
-#     message = """
-#     <html>
-#     <head>
-#         <style>
-#             .g-table {
-#             border: solid 3px #DDEEEE;
-#             border-collapse: collapse;
-#             border-spacing: 0;
-#             font: normal 14px Roboto, sans-serif;
-#             }
-
-#             .g-table th {
-#             background-color: #DDEFEF;
-#             border: solid 1px #DDEEEE;
-#             color: #336B5B;
-#             min-width: 72px;
-#             padding: 10px;
-#             text-align: left;
-#             text-shadow: 1px 1px 1px #fff;
-#             }
-
-#             .g-table td {
-#             border: solid 1px #DDEEEE;
-#             color: #333;
-#             padding: 10px;
-#             }
-#         </style>
-#     </head>
-#     <body>
-#     <h3>Absence worklog conflicts</h3>
-#     """
-
-#     if len(conflicts) == 0:
-#         message += "<p>No conflicts today!</p></body></html>"
-#         return message
-
-#     message += """
-#     <table class="g-table">
-#     <tr>
-#         <th>Employee</th>
-#         <th>Date</th>
-#         <th>Amount</th>
-#     </tr>
-#     """
-
-#     for email, worklogs in conflicts.items():
-#         for w in worklogs:
-#             message += f"""
-#             <tr>
-#                 <td>{email}</td>
-#                 <td>{w['date']}</td>
-#                 <td>{w['amount']}</td>
-#             </tr>
-#             """
-
-#     message += "</table></body></html>"
-#     return message
-
-
-def sync_timesheets():
-    contract_types = settings.get("calamari_timesheet_contract_types").split(",")
-    ignored_employees = settings.get("calamari_absence_ignored_employees").split(",")
-
-    for employee in calamari.get_employees():
-        if employee["contractType"]["name"] not in contract_types:
-            logging.debug("Skipping %s contract type: %s ignored by configuration", employee["email"],employee["contractType"]["name"])
+    return conflicts
+
+
+def _prepare_employee_absences(employee: calamari.Employee, workweeks: list, approved_absences: list) -> tuple:
+    """ Return (email, workweek, holiday calendar, approved absences, period start, period end) for an employee """
+
+    period_start, period_end = get_dates_range()
+    employee_email = employee.email
+    workweek=calamari.get_workweek(workweeks, employee.workweek_id)
+    logging.debug("%d approved absences of %s", len(approved_absences), employee_email)
+
+    # absence can span before or after synchronization period
+    for absence in approved_absences:
+
+        absence_start = datetime.strptime(absence["from"], "%Y-%m-%d")
+        absence_end = datetime.strptime(absence["to"], "%Y-%m-%d")
+        if absence_start < period_start:
+            logging.debug("Absence date %s is < period_start (%s)", absence_start, period_start.strftime("%Y-%m-%d"))
+            period_start = absence_start
+        if absence_end > period_end:
+            logging.debug("Absence date %s is > period_end (%s)", absence_end, period_start.strftime("%Y-%m-%d"))
+            period_end = absence_end
+
+    return employee_email, workweek, employee.holiday_calendar, approved_absences, period_start, period_end
+
+
+def _sync_employee_absences(absence_index: dict, employee_email: str, workweek: list, holiday_calendar: str, approved_absences: list, period_start, period_end) -> tuple:
+    """ Compare absences of an employee with absence worklogs, return conflicting and missing worklogs """
+
+    absence_worklogs = jira.slice_tempo_absences(absence_index, employee_email, period_start, period_end)
+
+    employee_absences = calamari.filter_absences(
+        employee_email,
+        approved_absences,
+        workweek,
+        period_start,
+        period_end,
+        holiday_calendar,
+    )
+
+    logging.debug("Comparing %d absence days with %d absence worklogs of %s", len(employee_absences), len(absence_worklogs), employee_email)
+    diff = reconcile.diff_absences(employee_email, employee_absences, absence_worklogs)
+    if diff.in_sync:
+        logging.info("No conflicts for user %s", employee_email)
+        return [], []
+
+    for worklog in diff.missing:
+        logging.info("Worklog for absence of %s is missing on %s (%s hours)", employee_email, worklog.day, worklog.seconds / 3600)
+
+    return [worklog.as_conflict() for worklog in diff.extra], diff.missing
+
+
+def sync_timesheets(context: RunContext|None = None, shard: tuple|None = None) -> dict:
+    """ Make Calamari timesheets match Jira worklogs, return conflicts like sync_absences (there are none) """
+
+    if context is None:
+        context = build_context(absences=False, shard=shard)
+    contract_types = settings.load().calamari_timesheet_contract_types
+    ignored_employees = settings.load().calamari_absence_ignored_employees
+
+    employees = []
+    accounts = {}
+    for employee in context.employees:
+        if employee.contract_type not in contract_types:
+            logging.debug("Skipping %s contract type: %s ignored by configuration", employee.email, employee.contract_type)
+            continue
+        if employee.email in ignored_employees:
+            logging.debug("Skipping %s - ignored by configuration", employee.email)
             continue
-        if employee["email"] in ignored_employees:
-            logging.debug("Skipping %s - ignored by configuration", employee["email"])
+        # without an account there are no worklogs to compare with, an empty set would delete the whole timesheet
+        account_id = directory.find_account_id(employee.email)
+        if account_id is None:
+            logging.warning("User %s does not exist in jira. Skipping.", employee.email)
             continue
+        accounts[employee.email] = account_id
+        employees.append(employee)
 
-        jira_account_id = jira.get_account_id(employee["email"])
-        period_start, period_end = get_dates_range()
-        if settings.get("tempo_api_key") is None:
-            jira_worklogs = jira.fetch_jira_worklogs(
-                employee["email"], jira_account_id, period_start.date().isoformat(), period_end.date().isoformat()
+    period_start, period_end = get_dates_range()
+    with metrics.phase("timesheets:calamari"):
+        timesheets = calamari.fetch_timesheets_batch(
+            [employee.email for employee in employees], period_start.date().isoformat(), period_end.date().isoformat()
+        )
+
+    # Tempo worklogs of all employees are searched at once, Jira worklogs are fetched per employee
+    tempo_seconds = None
+    if _use_tempo():
+        with metrics.phase("timesheets:tempo"):
+            tempo_seconds = jira.sum_tempo_worklogs(
+                list(accounts.values()),
+                period_start.date().isoformat(),
+                period_end.date().isoformat(),
             )
-        else: 
-            jira_worklogs = jira.fetch_tempo_worklogs(
-                jira_account_id, period_start.date().isoformat(), period_end.date().isoformat()
+
+    # incremental synchronization is enabled by configuring a state store, Tempo sums cover the whole period anyway
+    store = state.get_store(sharding.partition(context.shard)) if tempo_seconds is None else None
+    run_started = datetime.now(timezone.utc)
+
+    def sync_employee(employee):
+        with metrics.employee(employee.email):
+            return _sync_employee_timesheets(
+                employee,
+                accounts[employee.email],
+                timesheets[employee.email],
+                _load_checkpoint(store, employee.email, run_started),
+                run_started,
+                None if tempo_seconds is None else tempo_seconds.get(accounts[employee.email], {}),
             )
-        #logging.debug("Jira worklogs: %s", jira_worklogs)
-        calamari_timesheet = calamari.fetch_timesheets(
-            employee["email"], period_start.date().isoformat(), period_end.date().isoformat()
-        )
-        #logging.debug("Calamari timesheets: %s", jira_worklogs)
-        _compare_worklogs_with_timesheet(employee["email"], jira_worklogs, calamari_timesheet)
 
-def _compare_worklogs_with_timesheet(employee_email: str, jira_worklogs: list, calamari_timesheet: list):
-    jira_sum = jira.sum_worklogs(jira_worklogs)
+    with metrics.phase("timesheets:employees"):
+        results = run_parallel(sync_employee, employees)
+
+    # changes of all employees are applied as one batch
+    with metrics.phase("timesheets:apply"):
+        planner.apply([op for _, operations in results for op in operations])
+
+    if store is not None and not planner.is_dry_run():
+        with metrics.phase("timesheets:state"):
+            for employee, (checkpoint, _) in zip(employees, results):
+                store.save(f"timesheets:{employee.email}", checkpoint)
+            store.flush()
+    return {}
+
+
+def _load_checkpoint(store, employee_email: str, run_started: datetime) -> dict|None:
+    """ Return the last checkpoint of an employee, None if a full synchronization is needed """
+
+    if store is None:
+        return None
+
+    checkpoint = store.load(f"timesheets:{employee_email}")
+    if checkpoint is None:
+        logging.debug("No checkpoint for %s, running full synchronization", employee_email)
+        return None
+
+    full_every = timedelta(hours=settings.load().sync_full_reconciliation_hours)
+    if run_started - datetime.fromisoformat(checkpoint["full_at"]) > full_every:
+        logging.debug("Periodic full synchronization for %s", employee_email)
+        return None
+
+    return checkpoint
+
+
+def _use_tempo() -> bool:
+    # the CloudFormation template always sets the variable, empty means native Jira worklogs
+    return bool(settings.get("tempo_api_token"))
+
+
+def _sync_employee_timesheets(employee: calamari.Employee, jira_account_id: str, calamari_timesheet: list, checkpoint: dict|None, run_started: datetime, worklog_seconds: dict|None = None) -> tuple:
+    """ Plan timesheet changes of an employee, return the new checkpoint and the operations
+
+    With a checkpoint only days changed since the last synchronization are
+    fetched and compared, otherwise the whole synchronization period is.
+    Worklog seconds per day already fetched from Tempo for all employees at
+    once are compared for the whole period without any further request and
+    without a checkpoint.
+    """
+
+    period_start, period_end = get_dates_range()
+    period_from = period_start.date().isoformat()
+    period_to = period_end.date().isoformat()
+
+    if worklog_seconds is not None:
+        jira_sum = {day: seconds / 3600 for day, seconds in worklog_seconds.items()}
+        return None, planner.plan_timesheet(employee.email, jira_sum, calamari_timesheet)
+
+    days = None
+    date_from, date_to = period_from, period_to
+    if checkpoint is not None:
+        days = _changed_days(employee.email, jira_account_id, checkpoint, calamari_timesheet, period_from, period_to)
+        if not days:
+            logging.info("No changes in timesheet of %s since %s", employee.email, checkpoint["synced_at"])
+        else:
+            date_from, date_to = min(days), max(days)
+            logging.debug("Synchronizing days changed since %s for %s: %s", checkpoint["synced_at"], employee.email, sorted(days))
+
+    if days is None or days:
+        jira_worklogs = jira.fetch_jira_worklogs(employee.email, jira_account_id, date_from, date_to)
+        jira_sum, operations = _compare_worklogs_with_timesheet(employee.email, jira_worklogs, calamari_timesheet, days)
+    else:
+        jira_sum, operations = {}, []
+
+    return _checkpoint(checkpoint, run_started, period_from, period_to, jira_sum, days), operations
+
+
+def _checkpoint(checkpoint: dict|None, run_started: datetime, period_from: str, period_to: str, jira_sum: dict, days: set|None) -> dict:
+    """ Return the new checkpoint of an employee, days are those synchronized in this run (None for all) """
+
+    # days not synchronized in this run keep their previous state
+    day_hashes = {}
+    if days is not None:
+        day_hashes = {
+            day: h for day, h in checkpoint["days"].items()
+            if period_from <= day <= period_to and day not in days
+        }
+    for day, hours in jira_sum.items():
+        if days is None or day in days:
+            seconds = round(hours * 3600)
+            if seconds > 0:
+                day_hashes[day] = state.day_hash(seconds, seconds)
+
+    return {
+        "synced_at": run_started.isoformat(),
+        "full_at": run_started.isoformat() if days is None else checkpoint["full_at"],
+        "period_to": period_to,
+        "days": day_hashes,
+    }
+
+
+def _changed_days(employee_email: str, jira_account_id: str, checkpoint: dict, calamari_timesheet: list, period_from: str, period_to: str) -> set:
+    """ Return days which need to be synchronized again since the checkpoint """
+
+    updated_from = datetime.fromisoformat(checkpoint["synced_at"])
+    updated_worklogs = jira.fetch_jira_worklogs(employee_email, jira_account_id, period_from, period_to, updated_from)
+    days = {worklog.date for worklog in updated_worklogs}
+
+    # timesheet days edited in Calamari (or removed from it) since the last run
     calamari_sum = calamari.sum_timesheets(calamari_timesheet)
-    
-    logging.debug("Jira sum: %s", jira_sum)
-    logging.debug("Calamari sum: %s", calamari_sum)
-    for day in jira_sum:
-        if jira_sum[day] == float(calamari_sum[day]/3600):
-            logging.info("Calamari timesheet for %s is in sync with Jira worklogs on day %s", employee_email, day)
-            continue
+    for day in set(calamari_sum) | set(checkpoint["days"]):
+        if period_from <= day <= period_to:
+            seconds = round(calamari_sum[day])
+            expected = checkpoint["days"].get(day)
+            if (expected is None and seconds > 0) or (expected is not None and expected != state.day_hash(seconds, seconds)):
+                days.add(day)
+
+    # days which entered the synchronization period since the last run
+    day = max(date.fromisoformat(checkpoint["period_to"]) + timedelta(days=1), date.fromisoformat(period_from))
+    while day.isoformat() <= period_to:
+        days.add(day.isoformat())
+        day += timedelta(days=1)
+
+    return days
+
+
+def _compare_worklogs_with_timesheet(employee_email: str, jira_worklogs, calamari_timesheet: list, days: set|None = None) -> tuple:
+    """ Compare Calamari timesheet with Jira worklogs, limited to days if given
+
+    Return Jira sums per day and the operations making the timesheet match them.
+    """
+
+    # worklogs are streamed page by page into the daily sums
+    if days is not None:
+        jira_worklogs = (w for w in jira_worklogs if w.date in days)
+        calamari_timesheet = [t for t in calamari_timesheet if t["started"][0:10] in days]
+
+    jira_sum = jira.sum_worklogs(jira_worklogs)
+    logging.debug("Worklogs of %s on %d days", employee_email, len(jira_sum))
 
-        # remove old entry from timesheet if necessary
-        if calamari_sum[day] > 0:
-            for entry in calamari_timesheet:
-                if day == entry["started"][0:10]:
-                    logging.debug("Deleting timesheet entry for %s on day %s", employee_email, day)
-                    calamari.delete_timesheet(int(entry["id"]))
-
-        # create an entry in timesheet
-        logging.info("Creating timesheet entry for %s on day %s (hours %s)", employee_email, day, jira_sum[day])
-        calamari.create_timesheet(employee_email, day, jira_sum[day])
-
-    for day in [d for d in calamari_sum if d not in jira_sum]:
-        for worklog in calamari_timesheet:
-            if day == worklog["started"][0:10]:
-                logging.info("Deleting timesheet entry for %s on day %s", employee_email, day)
-                calamari.delete_timesheet(int(worklog["id"]))
+    return jira_sum, planner.plan_timesheet(employee_email, jira_sum, calamari_timesheet)
@@ -1,17 +1,72 @@
 import logging
 
-import src.jobs as jobs
 import src.utils.settings as settings
 
 def lambda_handler(event, context):
-    logging.getLogger().setLevel(level=logging.DEBUG if int(settings.get('debug', '0')) else logging.INFO)
+    logging.getLogger().setLevel(level=logging.DEBUG if settings.load().debug else logging.INFO)
+
+    # jobs pull in the API clients (requests), import them only when a job runs
+    import src.jobs as jobs
+    import src.utils.calamari as calamari
+    import src.utils.httpcache as httpcache
+    import src.utils.metrics as metrics
+    import src.utils.report as report
+    import src.utils.sharding as sharding
+
+    # employees are listed once per invocation, warm containers reuse the cached listing only within its TTL
+    calamari.get_employees.cache_clear()
+    # holidays are kept in memory for a single run too, CALAMARI_HOLIDAY_CACHE_TTL applies across runs
+    calamari._get_holidays_of_year.cache_clear()
+
+    # follow-up invocation rendering and delivering the conflict report of a job
+    if event["job"] == "send-report":
+        report.deliver(event["source"], event["conflicts"], event.get("inline", False))
+        return None
 
     available_jobs = {
         "sync-absences": jobs.sync_absences,
         "sync-timesheets": jobs.sync_timesheets,
+        "sync-all": jobs.sync_all,
     }
 
-    if event["job"] in available_jobs:
-        available_jobs[event["job"]]()
-    else:
-        logging.error("Unknown job, please choose `sync-absences` or `sync-timesheets`")
+    if event["job"] not in available_jobs:
+        logging.error("Unknown job, please choose `sync-absences`, `sync-timesheets` or `sync-all`")
+        return None
+
+    # orchestrator mode: split employees into shards and run each as its own invocation
+    shards = int(event.get("shards", 1))
+    if "shard" not in event and shards > 1:
+        if context is None:
+            invoke = sharding.local_invoker(lambda_handler)
+        else:
+            # leave a few seconds to merge the reports before this invocation times out
+            invoke = sharding.lambda_invoker(context.invoked_function_arn, context.get_remaining_time_in_millis() / 1000 - 5)
+        metrics.reset()
+        try:
+            result = sharding.fan_out(event["job"], shards, invoke)
+            report.submit(event["job"], result["conflicts"], _function_name(context))
+            return result
+        finally:
+            report.wait()
+            metrics.emit(event["job"])
+
+    shard = (int(event["shard"]), int(event["of"])) if "shard" in event else None
+    # shards run in-process share the metrics of the local orchestrator
+    collect_metrics = context is not None or shard is None
+    if collect_metrics:
+        metrics.reset()
+    try:
+        conflicts = available_jobs[event["job"]](shard=shard)
+        # shards leave the report to their orchestrator
+        if shard is None:
+            report.submit(event["job"], conflicts, _function_name(context))
+        return {"conflicts": conflicts}
+    finally:
+        httpcache.wait()
+        report.wait()
+        if collect_metrics:
+            metrics.emit(event["job"], shard)
+
+
+def _function_name(context) -> str|None:
+    return None if context is None else context.invoked_function_arn
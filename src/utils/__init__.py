@@ -1,5 +0,0 @@
-import src.utils.aws
-import src.utils.calamari
-import src.utils.jira
-
-
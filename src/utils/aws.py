@@ -1,18 +1,116 @@
 import logging
-import boto3
+from functools import cache
 
 import src.utils.settings as settings
 
-ses = boto3.client("ses", region_name="eu-west-1")
+
+# clients are created once per container, and boto3 is imported on first use:
+# runs which never talk to an AWS service don't pay for it
+
+
+@cache
+def _ses_client():
+    import boto3
+
+    return boto3.client("ses", region_name="eu-west-1")
 
 
 def send_email(subject: str, message: str, addresses: list[str]):
     from_address = settings.get("notification_from_email")
     message = {"Subject": {"Data": subject}, "Body": {"Html": {"Data": message}}}
-    ses.send_email(
+    _ses_client().send_email(
         Source=from_address,
         Destination={"ToAddresses": addresses},
         Message=message,
     )
     logging.info("Sending email \"%s\" to %s", subject, ", ".join(addresses))
 
+
+@cache
+def _lambda_client(read_timeout: int|None = None):
+    """ Return a Lambda client, clients of synchronous invocations wait at most read_timeout seconds """
+
+    import boto3
+
+    if read_timeout is None:
+        return boto3.client("lambda")
+
+    from botocore.config import Config
+
+    # a retried invocation would run the function twice
+    return boto3.client(
+        "lambda",
+        config=Config(read_timeout=read_timeout, connect_timeout=10, retries={"total_max_attempts": 1}),
+    )
+
+
+def invoke_async(function_name: str, payload: str):
+    """ Start an asynchronous invocation of a Lambda function, without waiting for its result """
+
+    _lambda_client().invoke(FunctionName=function_name, InvocationType="Event", Payload=payload.encode())
+
+
+def invoke(function_name: str, payload: str, timeout: float) -> dict:
+    """ Invoke a Lambda function and wait at most timeout seconds for its response, it is never retried """
+
+    # timeouts are whole seconds, a container keeps one client per distinct timeout
+    return _lambda_client(max(int(timeout), 1)).invoke(FunctionName=function_name, Payload=payload.encode())
+
+
+@cache
+def _s3_client():
+    import boto3
+
+    return boto3.client("s3")
+
+
+def read_object(bucket: str, key: str) -> bytes|None:
+    """ Return the content of an S3 object, None if it doesn't exist """
+
+    client = _s3_client()
+    try:
+        return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except client.exceptions.NoSuchKey:
+        return None
+
+
+def write_object(bucket: str, key: str, body: bytes):
+    _s3_client().put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def upload_file(path: str, bucket: str, key: str):
+    """ Upload a local file to S3, streamed from disk """
+
+    _s3_client().upload_file(path, bucket, key)
+
+
+def read_lines(bucket: str, key: str):
+    """ Yield lines of an S3 object, streamed rather than read at once """
+
+    body = _s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+    for line in body.iter_lines():
+        yield line.decode()
+
+
+def presigned_url(bucket: str, key: str, expires: int) -> str:
+    """ Return a URL anyone can download the S3 object from for expires seconds """
+
+    return _s3_client().generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires)
+
+
+@cache
+def _ssm_client():
+    import boto3
+
+    return boto3.client("ssm")
+
+
+def get_parameters_by_path(path: str) -> dict:
+    """ Return decrypted values of all SSM parameters under path, by parameter name """
+
+    parameters = {}
+    paginator = _ssm_client().get_paginator("get_parameters_by_path")
+    for page in paginator.paginate(Path=path, Recursive=True, WithDecryption=True):
+        for parameter in page["Parameters"]:
+            parameters[parameter["Name"]] = parameter["Value"]
+    return parameters
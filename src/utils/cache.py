@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib.parse
+
+import src.utils.aws as aws
+import src.utils.settings as settings
+
+
+def _path(name: str) -> str:
+    cache_dir = settings.get("cache_dir", tempfile.gettempdir())
+    return os.path.join(cache_dir, f"calamari-jira-{name}.json")
+
+
+def _s3() -> tuple|None:
+    """ Return (bucket, key prefix) of the shared S3 cache, None if CACHE_S3_URL is not set """
+
+    location = settings.get("cache_s3_url")
+    if not location:
+        return None
+
+    url = urllib.parse.urlsplit(location)
+    return url.netloc, url.path.strip("/")
+
+
+def read(name: str) -> dict|None:
+    """ Return the entry stored under name with its stored_at time, regardless of its age
+
+    Entries missing in the local cache directory are read from the S3 cache,
+    if configured, and kept locally for the next invocations of the container.
+    """
+
+    try:
+        with open(_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.warning("Can't read cache %s: %s", name, e)
+        return None
+
+    entry = _read_s3(name)
+    if entry is not None:
+        _write_local(name, entry)
+    return entry
+
+
+def load(name: str, ttl: float):
+    """ Return value stored under name if it is younger than ttl seconds, None otherwise """
+
+    entry = read(name)
+    if entry is None:
+        return None
+
+    if time.time() - entry["stored_at"] > ttl:
+        logging.debug("Cache %s expired", name)
+        return None
+    return entry["value"]
+
+
+def store(name: str, value, **fields):
+    """ Persist a JSON serializable value, with optional extra fields, under name """
+
+    entry = {"stored_at": time.time(), "value": value, **fields}
+    _write_local(name, entry)
+    _write_s3(name, entry)
+
+
+def _write_local(name: str, entry: dict):
+    path = _path(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning("Can't write cache %s: %s", name, e)
+
+
+def _s3_key(prefix: str, name: str) -> str:
+    return f"{prefix}/{name}.json" if prefix else f"{name}.json"
+
+
+def _read_s3(name: str) -> dict|None:
+    s3 = _s3()
+    if s3 is None:
+        return None
+
+    bucket, prefix = s3
+    try:
+        body = aws.read_object(bucket, _s3_key(prefix, name))
+        return None if body is None else json.loads(body)
+    except Exception as e:
+        # the S3 cache only saves requests, it never fails the run
+        logging.warning("Can't read cache %s from S3: %s", name, e)
+        return None
+
+
+def _write_s3(name: str, entry: dict):
+    s3 = _s3()
+    if s3 is None:
+        return
+
+    bucket, prefix = s3
+    try:
+        aws.write_object(bucket, _s3_key(prefix, name), json.dumps(entry).encode())
+    except Exception as e:
+        logging.warning("Can't write cache %s to S3: %s", name, e)
@@ -1,48 +1,110 @@
 import datetime as dt
+import urllib.parse
 from collections import defaultdict
+from typing import NamedTuple
 
-import requests
-from requests.auth import HTTPBasicAuth
-
+import src.utils.cache as cache
+import src.utils.httpcache as httpcache
+import src.utils.metrics as metrics
 import src.utils.settings as settings
+import src.utils.transport as transport
+from src.utils.concurrency import locked_cache, run_parallel
 from src.utils.date import get_dates_range
+from src.utils.workcalendar import WorkCalendar
 
 import logging
 
-def api_call(path: str, body: dict|None = None, no_response: bool = False) -> dict|None:
+def api_call(path: str, body: dict|None = None, no_response: bool = False, idempotent: bool = True) -> dict|None:
     """ Make a call to Calamari API """
 
-    url = f"{settings.get('calamari_api_url')}/api/{path}"
-    auth = HTTPBasicAuth("calamari", settings.get("calamari_api_token"))
-    headers={"Accept": "application/json"}
+    res = _post(path, body, idempotent=idempotent)
+    res.raise_for_status()
+    return res.json() if not no_response else None
+
+
+def _post(path: str, body: dict|None = None, headers: dict|None = None, idempotent: bool = True):
+    """ Send a request to Calamari API, return the response """
+
+    url, base_headers, auth = _request(path)
 
-    res = requests.request(
+    # every Calamari endpoint is a POST, so reads are flagged as idempotent
+    # explicitly to let the transport retry them on 5xx responses
+    return transport.get_client("calamari").request(
         "POST", url,
-        headers=headers,
+        idempotent=idempotent,
+        headers={**base_headers, **(headers or {})},
         auth=auth,
         json=body,
     )
-    logging.debug("Calamari API response [%s]: %s", res.status_code, res.text)
-    logging.debug("Calamari API payload: %s", body)
-    logging.debug("Calamari API headers: %s", headers)
 
-    res.raise_for_status()
-    return res.json() if not no_response else None
 
+def _request(path: str) -> tuple:
+    """ Return url, headers and basic auth credentials of a Calamari API request """
+
+    url = f"{settings.get('calamari_api_url')}/api/{path}"
+    auth = ("calamari", settings.get("calamari_api_token"))
+    headers = {"Accept": "application/json"}
+    return url, headers, auth
+
+
+class Employee(NamedTuple):
+    """ Employee fields used by the synchronization jobs """
+
+    email: str
+    contract_type: str|None
+    workweek_id: int|None
+    holiday_calendar: str
+
+
+@locked_cache
+def get_employees() -> tuple:
+    """ Return employees from Calamari, listed once per run
+
+    The whole listing is cached as a single snapshot for
+    CALAMARI_EMPLOYEES_CACHE_TTL, and never served stale. The first page
+    tells how many pages there are, the remaining pages are fetched in
+    parallel. Employees listed twice (pages shifting while they are read)
+    are kept once.
+    """
+
+    cache_name = f"employees-{_host()}"
+    records = cache.load(cache_name, settings.load().calamari_employees_cache_ttl)
+    if records is not None:
+        metrics.record_cache("employees", "hit")
+        return tuple(Employee(*record) for record in records)
+
+    metrics.record_cache("employees", "miss")
+    first = api_call("employees/v1/list", body={"page": 0})
+    pages = run_parallel(
+        lambda page: api_call("employees/v1/list", body={"page": page}),
+        range(first["currentPage"] + 1, first["totalPages"] + 1),
+    )
+
+    employees = {}
+    for res in [first, *pages]:
+        for record in res["employees"]:
+            employee = _employee(record)
+            if employee.email in employees:
+                logging.warning("Employee %s listed twice by Calamari, keeping the first record", employee.email)
+                continue
+            employees[employee.email] = employee
 
-def get_employees() -> list:
-    """ Return a list of employees from Calamari """
+    cache.store(cache_name, list(employees.values()))
+    return tuple(employees.values())
 
-    results = []
-    page = 0
-    while True:
-        res = api_call("employees/v1/list", body={"page": page})
-        results.extend(res["employees"])
 
-        if res["currentPage"] == res["totalPages"]:
-            return results
+def _host() -> str:
+    return urllib.parse.urlsplit(settings.get("calamari_api_url")).hostname
+
+
+def _employee(record: dict) -> Employee:
+    return Employee(
+        email=record["email"],
+        contract_type=(record.get("contractType") or {}).get("name"),
+        workweek_id=(record.get("workingWeek") or {}).get("id"),
+        holiday_calendar=get_holiday_calendar(record),
+    )
 
-        page = res["currentPage"] + 1
 
 def get_employee(email: str) -> dict:
     """ Return employee configuration """
@@ -52,7 +114,12 @@ def get_employee(email: str) -> dict:
 def get_workweeks() -> list:
     """ Get workweeks configuration """
     
-    return api_call("working-week/v1/all")
+    # every Calamari endpoint is a POST, its responses are cached by TTL only
+    return httpcache.get(
+        "workweeks", _host(), settings.load().calamari_workweeks_cache_ttl,
+        lambda headers: _post("working-week/v1/all", headers=headers),
+        conditional=False,
+    )
     
 def get_workweek(workweeks: list, workweek_id: int) -> list|None:
     for workweek in workweeks:
@@ -61,33 +128,15 @@ def get_workweek(workweeks: list, workweek_id: int) -> list|None:
     return None
     
 
-def get_working_hours(workweek: list, day: str) -> float|None:
-    """ Find employee workweek configuration """
-    
-    for workday in workweek['workingDays']:
-        if workday['dayName'] == day:
-            if workday['duration']:
-                return float(workday['duration']/60/60)
-            else:
-                return 0.0
-    return None
+def fetch_timesheets_batch(emails: list, date_from: str, date_to: str) -> dict:
+    """ Fetch timesheets of many employees from Calamari, grouped by employee email """
 
-def average_working_hours_per_week(workweek: list) -> float|None:
-    sum=0.0
-    days=0
-    for workday in workweek['workingDays']:
-        if workday['duration']:
-           sum+=workday['duration']
-           days+=1
-    if sum == 0.0 or days == 0:
-        return None
-    return sum/days/60/60
-    
-
-def fetch_timesheets(email: str, date_from: str, date_to: str) -> list:
-    """ Fetch employee timesheets from Calamari """
-
-    return api_call("clockin/timesheetentries/v1/find", {"from": date_from, "to": date_to, "employees": [email]})
+    return _find_batch(
+        "clockin/timesheetentries/v1/find",
+        emails,
+        lambda chunk: {"from": date_from, "to": date_to, "employees": chunk},
+        "person",
+    )
 
 
 def sum_timesheets(worklogs: list) -> dict:
@@ -105,53 +154,122 @@ def delete_timesheet(timesheet_id: int):
     return api_call("clockin/timesheetentries/v1/delete", {"id": timesheet_id}, no_response=True)
 
 
-def create_timesheet(person: str, shift_day: str, hours: float):
-    """ Create timesheet entry in Calamari """
+def _shift(shift_day: str, hours: float) -> tuple:
+    """ Return shift start and end (ISO format) of a timesheet entry """
 
     shift_start = dt.datetime.fromisoformat(shift_day).replace(tzinfo=None).replace(hour=8)
     shift_end = shift_start + dt.timedelta(hours=hours)
 
+    return shift_start.isoformat(timespec='seconds'), shift_end.isoformat(timespec='seconds')
+
+
+def create_timesheet(person: str, shift_day: str, hours: float):
+    """ Create timesheet entry in Calamari """
+
+    shift_start, shift_end = _shift(shift_day, hours)
     body = {
         "person": person,
-        "shiftStart": shift_start.isoformat(timespec='seconds'),
-        "shiftEnd": shift_end.isoformat(timespec='seconds'),
+        "shiftStart": shift_start,
+        "shiftEnd": shift_end,
     }
-    api_call("clockin/timesheetentries/v1/create", body)
+    api_call("clockin/timesheetentries/v1/create", body, idempotent=False)
 
 
-def get_approved_absences(employee_email: dict) -> dict:
-    """ Fetch all approved absences for user """
+def update_timesheet(timesheet_id: int, shift_day: str, hours: float):
+    """ Update timesheet entry in Calamari """
 
-    period_start, period_end = get_dates_range()
+    shift_start, shift_end = _shift(shift_day, hours)
     body = {
-        "from": period_start.date().isoformat(),
-        "to": period_end.date().isoformat(),
-        "employees": [employee_email],
-        "absenceStatuses": ["APPROVED"],
+        "id": timesheet_id,
+        "shiftStart": shift_start,
+        "shiftEnd": shift_end,
     }
+    api_call("clockin/timesheetentries/v1/update", body)
+
+
+def get_approved_absences_batch(emails: list) -> dict:
+    """ Fetch all approved absences of many employees, grouped by employee email """
+
+    period_start, period_end = get_dates_range()
+    return _find_batch(
+        "leave/request/v1/find-advanced",
+        emails,
+        lambda chunk: {
+            "from": period_start.date().isoformat(),
+            "to": period_end.date().isoformat(),
+            "employees": chunk,
+            "absenceStatuses": ["APPROVED"],
+        },
+        "employee",
+    )
+
+
+def _find_batch(path: str, emails: list, make_body, employee_field: str) -> dict:
+    """ Query a Calamari find endpoint for chunks of employees and split the results per email """
 
-    return api_call("leave/request/v1/find-advanced", body)
+    batch_size = settings.load().calamari_batch_size
+    chunks = [emails[i:i + batch_size] for i in range(0, len(emails), batch_size)]
+    responses = run_parallel(lambda chunk: api_call(path, make_body(chunk)), chunks)
+
+    result = {email: [] for email in emails}
+    by_lower = {email.lower(): email for email in emails}
+    for records in responses:
+        for record in records:
+            email = by_lower.get(record[employee_field]["email"].lower())
+            if email is None:
+                logging.warning("Unexpected employee %s in %s response", record[employee_field]["email"], path)
+                continue
+            result[email].append(record)
+
+    return result
+
+
+def get_holiday_calendar(employee: dict) -> str:
+    """ Return key of the holiday calendar of an employee, employees sharing it share holidays """
+
+    calendar = employee.get("holidayCalendar")
+    if calendar:
+        return f"calendar-{calendar['id']}"
+    # no calendar information, holidays can't be shared with other employees
+    return f"employee-{employee['email']}"
 
 
-def get_holidays(employee_email: str, period_start, period_end) -> list:
-    """ Fetch holidays from Calamari """
+def get_holidays(employee_email: str, period_start, period_end, holiday_calendar: str|None = None) -> set:
+    """ Fetch holidays from Calamari, holidays are cached per holiday calendar and year """
+
+    if holiday_calendar is None:
+        holiday_calendar = f"employee-{employee_email}"
+
+    result = set()
+    for year in range(period_start.year, period_end.year + 1):
+        result.update(_get_holidays_of_year(holiday_calendar, employee_email, year))
+    return result
+
+
+@locked_cache(key=lambda holiday_calendar, employee_email, year: (holiday_calendar, year))
+def _get_holidays_of_year(holiday_calendar: str, employee_email: str, year: int) -> list:
+    cache_name = f"holidays-{_host()}-{holiday_calendar}-{year}"
+    holidays = cache.load(cache_name, settings.load().calamari_holiday_cache_ttl)
+    if holidays is not None:
+        return holidays
 
-    #period_start, period_end = get_dates_range()
     body = {
         "employee": employee_email,
-        "from": period_start.strftime("%Y-%m-%d"),
-        "to": period_end.strftime("%Y-%m-%d")
+        "from": f"{year}-01-01",
+        "to": f"{year}-12-31",
     }
 
     res = api_call("holiday/v1/find", body)
-    return [i["start"] for i in res]
+    holidays = [i["start"] for i in res]
+    cache.store(cache_name, holidays)
+    return holidays
 
 
-def filter_absences(employee_email: str, absences: dict, workweek: list, period_start, period_end) -> list:
+def filter_absences(employee_email: str, absences: dict, workweek: list, period_start, period_end, holiday_calendar: str|None = None) -> list:
     """ Filter absences from Calamari based on mail, type and holidays """
 
-    ignored_types = settings.get("calamari_absence_ignored_types").split(",")
-    holidays = get_holidays(employee_email, period_start, period_end)
+    ignored_types = settings.load().calamari_absence_ignored_types
+    calendar = WorkCalendar(workweek, get_holidays(employee_email, period_start, period_end, holiday_calendar))
     result = []
     
     for absence in absences:
@@ -162,7 +280,8 @@ def filter_absences(employee_email: str, absences: dict, workweek: list, period_
 
         absence_start = dt.date.fromisoformat(absence["from"])
         absence_end = dt.date.fromisoformat(absence["to"])
-        absence_length = (absence_end - absence_start).days
+        # every day of the absence with its working hours, used by both passes below
+        absence_days = calendar.expand(absence_start, absence_end)
         
         entitlements = []
         entitlement_amount = 0.0
@@ -170,40 +289,39 @@ def filter_absences(employee_email: str, absences: dict, workweek: list, period_
         entitlement_difference_per_day = 0.0
         non_working_days=0
         ### discover absences in 'calendar days' (include non-working-day and holidays) ###
-        for i in range(absence_length + 1):
-            date = absence_start + dt.timedelta(days=i)
+        for date, day, working_hours, is_holiday in absence_days:
 
-            if date.isoformat() in holidays:
-                logging.debug("Absence at %s for %s - it's a holiday", date.isoformat(), employee_email)
+            if is_holiday:
+                logging.debug("Absence at %s for %s - it's a holiday", day, employee_email)
                 non_working_days+=1
                 continue
-            if get_working_hours(workweek, date.strftime("%A").upper()) == 0:
-                logging.debug("Absence on %s for %s - it's outside of user working week configurtation", date.isoformat(), employee_email)
+            if working_hours == 0:
+                logging.debug("Absence on %s for %s - it's outside of user working week configurtation", day, employee_email)
                 non_working_days+=1
                 continue
             
             if absence['fullDayRequest'] == True:
                 if absence["entitlementAmountUnit"] == "HOURS":
-                    entitlement_amount = float(get_working_hours(workweek, date.strftime("%A").upper()))
+                    entitlement_amount = float(working_hours)
                 else:
                     entitlement_amount = 1.0
             else:
                 if absence_start == absence_end:
                     entitlement_amount=absence['entitlementAmount']
                 else:
-                    if date.isoformat() == absence["from"] and absence["amountFirstDay"]:
+                    if day == absence["from"] and absence["amountFirstDay"]:
                         entitlement_amount = float(absence["amountFirstDay"])
-                    elif date.isoformat() == absence["to"] and absence["amountLastDay"]:
+                    elif day == absence["to"] and absence["amountLastDay"]:
                         entitlement_amount = float(absence["amountLastDay"])
                     else:
                             if absence["entitlementAmountUnit"] == "HOURS":
-                                entitlement_amount = float(get_working_hours(workweek, date.strftime("%A").upper()))
+                                entitlement_amount = float(working_hours)
                             else:
                                 entitlement_amount = 1.0
             
             sanity_check_sum+=entitlement_amount
             entitlements.append({
-                "date": date.isoformat(),
+                "date": day,
                 "amount": entitlement_amount,
             })
         
@@ -215,32 +333,30 @@ def filter_absences(employee_email: str, absences: dict, workweek: list, period_
         
     
         ### prepare absences list for tempo (in hours) ##
-        for i in range(absence_length + 1):
-            
-            date = absence_start + dt.timedelta(days=i)
+        for date, day, working_hours, is_holiday in absence_days:
         
             # skip holidays and non-working days
-            if (date.isoformat() in holidays) or (get_working_hours(workweek, date.strftime("%A").upper()) == 0):
+            if is_holiday or working_hours == 0:
                 if entitlement_difference_per_day != 0.0:
                     if absence["entitlementAmountUnit"] == "HOURS":
                         hours = entitlement_difference_per_day
                     else:
-                        hours = average_working_hours_per_week(workweek) # a little simplification
+                        hours = calendar.average_hours # a little simplification
                         if hours is None:
-                            logging.warning("Can't estimate average working hours for employee with flexible work schedule. Skipping absence for %s",date.isoformat())
+                            logging.warning("Can't estimate average working hours for employee with flexible work schedule. Skipping absence for %s",day)
                             continue
                         # hours = 8
                 else:
-                    logging.debug("Skipping absence at %s for %s - it's a holiday or employee non-working day", date.isoformat(), employee_email)
+                    logging.debug("Skipping absence at %s for %s - it's a holiday or employee non-working day", day, employee_email)
                     continue
             else:
                 if absence['fullDayRequest'] == True:
-                    hours = get_working_hours(workweek, date.strftime("%A").upper())
+                    hours = working_hours
                 else:
                     if absence["entitlementAmountUnit"] == "HOURS":
                         units=1
                     elif absence["entitlementAmountUnit"] == "DAYS":
-                        units=get_working_hours(workweek, date.strftime("%A").upper())
+                        units=working_hours
                     else:
                         logging.error("Unknown entitlementAmountUnit")
                             
@@ -248,16 +364,16 @@ def filter_absences(employee_email: str, absences: dict, workweek: list, period_
                     if absence_start == absence_end:
                         hours=absence['entitlementAmount']* units
                     else:
-                        if date.isoformat() == absence["from"] and absence["amountFirstDay"]:
+                        if day == absence["from"] and absence["amountFirstDay"]:
                             hours = absence["amountFirstDay"] * units
-                        elif date.isoformat() == absence["to"] and absence["amountLastDay"]:
+                        elif day == absence["to"] and absence["amountLastDay"]:
                             hours = absence["amountLastDay"] * units
                         else:
-                            hours = get_working_hours(workweek, date.strftime("%A").upper())
+                            hours = working_hours
                 
             result.append({
-                "date": date.isoformat(),
+                "date": day,
                 "amount": hours,
             })
-    logging.debug("Result: %s", result)       
+    logging.debug("%d absence days of %s between %s and %s", len(result), employee_email, period_start, period_end)
     return result
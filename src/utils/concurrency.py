@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+import src.utils.settings as settings
+
+
+def run_parallel(func, items: list) -> list:
+    """ Call func for every item in a bounded thread pool, results keep the input order """
+
+    items = list(items)
+    workers = settings.load().sync_workers
+    if workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def locked_cache(func=None, *, key=None):
+    """ Thread-safe replacement for functools.cache
+
+    Concurrent callers asking for the same arguments wait for the first call
+    instead of sending the same request again. An optional key function maps
+    the call arguments to the cache key.
+    """
+
+    if func is None:
+        return lambda f: locked_cache(f, key=key)
+
+    results = {}
+    locks = {}
+    lock = threading.Lock()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        cache_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+        if cache_key in results:
+            return results[cache_key]
+
+        with lock:
+            key_lock = locks.setdefault(cache_key, threading.Lock())
+        with key_lock:
+            if cache_key not in results:
+                results[cache_key] = func(*args, **kwargs)
+        return results[cache_key]
+
+    def cache_clear():
+        with lock:
+            results.clear()
+            locks.clear()
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
@@ -1,9 +1,9 @@
 import datetime as dt
-from functools import cache
 import src.utils.settings as settings
+from src.utils.concurrency import locked_cache
 
 
-@cache
+@locked_cache
 def get_month_range() -> tuple:
     today = dt.datetime.now()
     next_month = today.replace(day=28) + dt.timedelta(days=4)
@@ -14,7 +14,7 @@ def get_month_range() -> tuple:
     return month_start, month_end
 
 
-@cache
+@locked_cache
 def get_month_range_yesterday() -> tuple:
     today = dt.datetime.now() - dt.timedelta(days=1)
     next_month = today.replace(day=28) + dt.timedelta(days=4)
@@ -24,15 +24,12 @@ def get_month_range_yesterday() -> tuple:
 
     return month_start, month_end
 
-@cache
+@locked_cache
 def get_dates_range() -> tuple:
     today = dt.datetime.today()
     
-    days_before = int(settings.get('days_before',30))
-    days_after = int(settings.get('days_after',30))
-    
-    if days_before > 90: days_before = 90 # it's our default max value
-    if days_after > 90: days_after = 90 # it's our default max value
+    days_before = settings.load().days_before
+    days_after = settings.load().days_after
     
     start_date = today-dt.timedelta(days=days_before)
     end_date = today+dt.timedelta(days=days_after)
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+import urllib.parse
+
+import src.utils.cache as cache
+import src.utils.settings as settings
+
+PAGE_SIZE = 1000
+
+
+class UserDirectory:
+    """ Bidirectional email <-> Jira account id map """
+
+    def __init__(self, users: list, loaded_at: float, from_api: bool):
+        self.users = users
+        self.loaded_at = loaded_at
+        self.from_api = from_api
+        self.by_email = {}
+        self.by_account = {}
+
+        for user in users:
+            self.by_account[user["accountId"]] = user["emailAddress"]
+            email = user["emailAddress"].lower()
+            # prefer active accounts if the same email is used more than once
+            if email not in self.by_email or user["active"]:
+                self.by_email[email] = user["accountId"]
+
+
+_lock = threading.Lock()
+_directory = None
+
+
+def _cache_name() -> str:
+    host = urllib.parse.urlsplit(settings.get("jira_api_url")).hostname
+    return f"users-{host}"
+
+
+def _ttl() -> float:
+    return settings.load().jira_user_directory_ttl
+
+
+def _fetch_users() -> list:
+    """ Fetch all Jira users with a visible email address """
+
+    # imported here to avoid a circular import with src.utils.jira
+    from src.utils.jira import jira_api_call
+
+    users = []
+    start_at = 0
+    while True:
+        page = jira_api_call(f"users/search?startAt={start_at}&maxResults={PAGE_SIZE}")
+        if not page:
+            break
+
+        for user in page:
+            if user.get("emailAddress"):
+                users.append({
+                    "accountId": user["accountId"],
+                    "emailAddress": user["emailAddress"],
+                    "active": user.get("active", True),
+                })
+        start_at += len(page)
+
+    logging.info("Loaded %d Jira users into the user directory", len(users))
+    return users
+
+
+def get_directory(stale: UserDirectory|None = None) -> UserDirectory:
+    """ Return the user directory, loading it from the local cache or Jira if needed
+
+    Passing the directory returned earlier as stale forces a reload from Jira,
+    unless another thread has already replaced it in the meantime.
+    """
+
+    global _directory
+
+    with _lock:
+        if _directory is not None and _directory is not stale and time.time() - _directory.loaded_at <= _ttl():
+            return _directory
+
+        users = None if stale is not None else cache.load(_cache_name(), _ttl())
+        if users is not None:
+            _directory = UserDirectory(users, time.time(), from_api=False)
+        else:
+            users = _fetch_users()
+            cache.store(_cache_name(), users)
+            _directory = UserDirectory(users, time.time(), from_api=True)
+        return _directory
+
+
+def _lookup(mapping: str, key: str) -> str|None:
+    directory = get_directory()
+    value = getattr(directory, mapping).get(key)
+    if value is None and not directory.from_api:
+        # the cached directory may predate the user, reload it from Jira once
+        logging.debug("%s not found in cached user directory, reloading it", key)
+        directory = get_directory(stale=directory)
+        value = getattr(directory, mapping).get(key)
+    return value
+
+
+def find_account_id(email: str) -> str|None:
+    """ Return Jira account id for an email address """
+
+    return _lookup("by_email", email.lower())
+
+
+def find_email(account_id: str) -> str|None:
+    """ Return email address of a Jira account """
+
+    return _lookup("by_account", account_id)
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import src.utils.cache as cache
+import src.utils.metrics as metrics
+import src.utils.settings as settings
+
+_lock = threading.Lock()
+_locks = {}
+_memory = {}
+_refreshing = {}
+# revalidations of stale responses, they run while the job goes on
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="httpcache")
+
+
+def get(resource: str, key: str, ttl: float, request, conditional: bool = True):
+    """ Return the JSON body of a cached GET-like request
+
+    request is called with conditional request headers (If-None-Match,
+    If-Modified-Since of the cached response) and returns the response.
+    Responses younger than ttl seconds are returned without any request,
+    responses within the HTTP_CACHE_STALE window after that are returned
+    while they are revalidated in the background, older ones are
+    revalidated before they are returned. Without conditional (POST
+    requests answer a matching precondition with 412, not 304), request
+    gets no headers and revalidation fetches the response again.
+    """
+
+    name = f"http-{resource}-{key}"
+    with _name_lock(name):
+        entry = _memory.get(name) or cache.read(name)
+        age = None if entry is None else time.time() - entry["stored_at"]
+
+        if age is not None and age <= ttl:
+            metrics.record_cache(resource, "hit")
+            _memory[name] = entry
+            return entry["value"]
+
+        if age is not None and age <= ttl + settings.load().http_cache_stale:
+            metrics.record_cache(resource, "stale")
+            _memory[name] = entry
+            if name not in _refreshing:
+                _refreshing[name] = _executor.submit(_refresh, resource, name, request, conditional)
+            return entry["value"]
+
+        return _revalidate(resource, name, entry, request, conditional)["value"]
+
+
+def wait():
+    """ Wait for background revalidations, a frozen Lambda container would never finish them """
+
+    with _lock:
+        pending = list(_refreshing.values())
+    for future in pending:
+        future.result()
+
+
+def _name_lock(name: str) -> threading.Lock:
+    with _lock:
+        return _locks.setdefault(name, threading.Lock())
+
+
+def _refresh(resource: str, name: str, request, conditional: bool):
+    try:
+        with _name_lock(name):
+            _revalidate(resource, name, _memory.get(name), request, conditional)
+    except Exception as e:
+        logging.warning("Can't revalidate cached %s: %s", name, e)
+    finally:
+        with _lock:
+            _refreshing.pop(name, None)
+
+
+def _revalidate(resource: str, name: str, entry: dict|None, request, conditional: bool) -> dict:
+    headers = {}
+    if conditional and entry is not None and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if conditional and entry is not None and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+
+    res = request(headers)
+    if res.status_code == 304 and headers:
+        metrics.record_cache(resource, "revalidated")
+        value, etag, last_modified = entry["value"], entry.get("etag"), entry.get("last_modified")
+    else:
+        res.raise_for_status()
+        metrics.record_cache(resource, "miss")
+        value, etag, last_modified = res.json(), res.headers.get("ETag"), res.headers.get("Last-Modified")
+
+    cache.store(name, value, etag=etag, last_modified=last_modified)
+    entry = _memory[name] = {"stored_at": time.time(), "value": value, "etag": etag, "last_modified": last_modified}
+    return entry
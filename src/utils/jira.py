@@ -1,234 +1,316 @@
 import logging
+import urllib.parse
 from collections import defaultdict
-from functools import cache
-
-import requests
-from requests.auth import HTTPBasicAuth
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple
 
+import src.utils.directory as directory
+import src.utils.httpcache as httpcache
 import src.utils.settings as settings
+import src.utils.transport as transport
+from src.utils.concurrency import locked_cache, run_parallel
 from src.utils.date import get_month_range
 from src.utils.date import get_dates_range
 
-import urllib.parse
+from datetime import datetime, timedelta, timezone
 
-from datetime import datetime
-import time
+# authors per worklogs/search request and worklogs per page (Tempo maximum)
+TEMPO_SEARCH_AUTHORS = 500
+TEMPO_SEARCH_PAGE_SIZE = 5000
 
 
-def jira_api_call(path: str, method: str = "GET", body: dict|None = None) -> dict:
-    """ Make a call to Jira API """
+class Worklog(NamedTuple):
+    """ Compact worklog record, pages of worklogs are streamed as these """
+
+    account_id: str
+    date: str
+    seconds: int
+    issue: str|None  # Jira issue key, Tempo issue URL
+
+
+def _jira_request(path: str) -> tuple:
+    """ Return url, headers and basic auth credentials of a Jira API request """
 
     url = f"{settings.get('jira_api_url')}/rest/api/3/{path}"
-    auth = HTTPBasicAuth(settings.get("jira_api_user"), settings.get("jira_api_token"))
+    auth = (settings.get("jira_api_user"), settings.get("jira_api_token"))
     headers = {
         "Accept": "application/json",
         "Content-Type": "application/json"
     }
+    return url, headers, auth
+
 
-    res = requests.request(
+def _tempo_request(path: str|None, next_url: str|None) -> tuple:
+    """ Return url and headers of a Tempo API request """
+
+    url = f"{settings.get('tempo_api_url', 'https://api.tempo.io/4')}/{path}" if next_url is None else next_url
+    headers = {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {settings.get('tempo_api_token')}"
+    }
+    return url, headers
+
+
+def jira_api_call(path: str, method: str = "GET", body: dict|None = None, idempotent: bool|None = None) -> dict:
+    """ Make a call to Jira API """
+
+    url, headers, auth = _jira_request(path)
+    res = transport.get_client("jira").request(
         method, url,
+        idempotent=idempotent,
         headers=headers,
         auth=auth,
         json=body,
     )
     
-    logging.debug("Jira API response [%s]: %s", res.status_code, res.text)
-    logging.debug("Request payload: %s",body)
-    logging.debug("Request headers: %s",headers)
     
     res.raise_for_status()
     return res.json()
 
 
-def tempo_api_call(path: str|None = None, method: str = "GET", body: dict|None = None, next_url: str|None = None) -> dict:
+def tempo_api_call(path: str|None = None, method: str = "GET", body: dict|None = None, next_url: str|None = None, idempotent: bool|None = None) -> dict:
     """ Make a call to Tempo API """
 
-    url = f"https://api.tempo.io/4/{path}" if next_url is None else next_url
-    res = requests.request(
+    url, headers = _tempo_request(path, next_url)
+    res = transport.get_client("tempo").request(
         method, url,
-        headers={
-            "Accept": "application/json",
-            "Authorization": f"Bearer {settings.get('tempo_api_token')}"
-        },
+        idempotent=idempotent,
+        headers=headers,
         json=body,
     )
-    logging.debug("Tempo API response [%s]: %s", res.status_code, res.text)
     
     res.raise_for_status()
     return res.json()
 
-@cache
-def get_issue_key(issue_id: str) -> str:
-    """ Get Jira Issue Kye from Issue Id """
 
-    return jira_api_call(f"issue/{issue_id}")["key"]
+def _get_issue(issue_id_or_key: str) -> dict:
+    """ Return id and key of an issue, both never change so they are cached for long """
+
+    def request(headers: dict):
+        url, base_headers, auth = _jira_request(f"issue/{issue_id_or_key}?fields=summary")
+        return transport.get_client("jira").request("GET", url, headers={**base_headers, **headers}, auth=auth)
+
+    host = urllib.parse.urlsplit(settings.get("jira_api_url")).hostname
+    return httpcache.get("issue", f"{host}-{issue_id_or_key}", settings.load().jira_issue_cache_ttl, request)
 
-@cache
 def get_account_id(email: str):
     """ Get Jira Account ID from user email address """
-    users = jira_api_call(f"user/search?query=" + urllib.parse.quote(email))
-    if not users:
+
+    account_id = directory.find_account_id(email)
+    if account_id is None:
         logging.warning("User with email %s not found in Jira.", email)
-        return None
-    return users[0]["accountId"]
+    return account_id
 
-@cache
+@locked_cache
 def get_user_email(account_id: str) -> str:
     """ Get user email address from Jira Account ID """
 
+    email = directory.find_email(account_id)
+    if email is not None:
+        return email
+    # accounts missing in the directory (e.g. app users) are looked up directly
     return jira_api_call(f"user?accountId={account_id}")["emailAddress"]
 
 def user_exists(email: str) -> bool:
-    if len(jira_api_call("user/search?query="+urllib.parse.quote(email))) > 0:
-        return True
-    else:
-        return False
+    return directory.find_account_id(email) is not None
+
+def fetch_jira_worklogs(employee_email: str, account_id: str, date_from: str, date_to: str, updated_from: datetime|None = None) -> Iterator[Worklog]:
+    """ Yield worklogs of user from Jira, optionally only those updated since updated_from (UTC) """
 
-def fetch_jira_worklogs(employee_email: str, account_id: str, date_from: str, date_to: str) -> list:
+    # bounds are compared as ISO dates (YYYY-MM-DD), normalize them once
+    date_from = datetime.strptime(date_from, '%Y-%m-%d').date().isoformat()
+    date_to = datetime.strptime(date_to, '%Y-%m-%d').date().isoformat()
 
-    # account_id = get_account_id(employee_email)
-    # Format JQL to filter issues with worklogs by the user
-    jql = f"worklogAuthor = {account_id} AND updated >= {date_from} AND updated <= {date_to}"
+    jql = f"worklogAuthor = {account_id} AND worklogDate >= {date_from} AND worklogDate <= {date_to}"
+    if updated_from is not None:
+        # JQL dates use the API user time zone, keep a day of margin and
+        # compare exact worklog update times below
+        jql += f" AND updated >= {(updated_from - timedelta(days=1)).date().isoformat()}"
     next_token = None
-    max_results = 50
-    result  = []
+    max_results = 100
 
     while True:
-        # search_url = f"{jira_base_url}/rest/api/3/search"
         payload = {
             "jql": jql,
             "maxResults": max_results,
+            # worklogs are embedded in the search results, so there is no
+            # need to request them per issue unless the list is truncated
+            "fields": ["worklog"],
             **({"nextPageToken": next_token} if next_token else {})
-            # "fields": "worklog"
         }
 
-        # response = requests.get(search_url, headers=headers, params=params, auth=auth)
-        # response.raise_for_status()
-        # data = response.json()
-        data = jira_api_call("search/jql","POST",payload)
+        data = jira_api_call("search/jql", "POST", payload, idempotent=True)
         issues = data.get('issues', [])
 
         if not issues:
             break
 
         for issue in issues:
-            issue_id = issue['id']
-            # worklog_url = f"{jira_base_url}/rest/api/3/issue/{issue_id}/worklog"
-            # wl_response = requests.get(worklog_url, headers=headers, auth=auth)
-            # wl_response.raise_for_status()
-            worklog_data = jira_api_call(f"issue/{issue_id}/worklog")
+            worklog_field = issue['fields']['worklog']
+            worklogs = worklog_field.get('worklogs', [])
+            if worklog_field.get('total', 0) > len(worklogs):
+                worklogs = _fetch_issue_worklogs(issue['id'], date_from)
 
-            for wl in worklog_data.get('worklogs', []):
+            for wl in worklogs:
                 wl_author_id = wl['author']['accountId']
-                started = wl['started']
-                started_date = datetime.strptime(started[:10], '%Y-%m-%d').date()
-                start_dt = datetime.strptime(date_from, '%Y-%m-%d').date()
-                end_dt = datetime.strptime(date_to, '%Y-%m-%d').date()
-                
-                if wl_author_id == account_id and start_dt <= started_date <= end_dt:
-                    result.append({
-                        "timeSpentSeconds": wl['timeSpentSeconds'],
-                        "startDate": wl['started'],
-                        "accountId": wl_author_id,
-                        "email": employee_email,
-                        "issueKey": get_issue_key(issue_id)
-                    })
+                started_date = wl['started'][:10]
+
+                if updated_from is not None and datetime.strptime(wl['updated'], '%Y-%m-%dT%H:%M:%S.%f%z') < updated_from:
+                    continue
+
+                if wl_author_id == account_id and date_from <= started_date <= date_to:
+                    yield Worklog(wl_author_id, started_date, wl['timeSpentSeconds'], issue['key'])
 
         next_token = data.get("nextPageToken")
         is_last = data.get("isLast", True)
 
         if is_last or not next_token:
             break
-        time.sleep(0.5)  # throttle to avoid API limits
-
-    return result
 
 
-def fetch_tempo_worklogs(employee_email: str, account_id: str, date_from: str, date_to: str) -> list:
-    """ Fetch worklogs for user from Tempo """
+def _fetch_issue_worklogs(issue_id: str, date_from: str) -> list:
+    """ Fetch all worklogs of an issue started on or after date_from """
 
-    next_url = None
+    # one day margin, startedAfter is compared with the worklog time in UTC
+    started_after = datetime.strptime(date_from, '%Y-%m-%d') - timedelta(days=1)
+    started_after_ms = int(started_after.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    start_at = 0
     result = []
 
     while True:
-        if account_id is None:
-            logging.warning("Account ID is None for email %s. Skipping Tempo worklog fetch.", employee_email)
+        data = jira_api_call(f"issue/{issue_id}/worklog?startAt={start_at}&maxResults=5000&startedAfter={started_after_ms}")
+        worklogs = data.get('worklogs', [])
+        result.extend(worklogs)
+        start_at += len(worklogs)
+
+        if not worklogs or start_at >= data.get('total', 0):
             return result
 
-        response = tempo_api_call(f"worklogs/user/{account_id}?from={date_from}&to={date_to}", next_url=next_url)
 
-        for record in response["results"]:
-            result.append({
-                "timeSpentSeconds": record["timeSpentSeconds"],
-                "startDate": record["startDate"],
-                "accountId": record["author"]["accountId"],
-                "email": employee_email,
-                "issueKey": record["issue"]["self"],
-            })
+def iter_tempo_pages(path: str, body: dict|None = None) -> Iterator[list]:
+    """ Yield results of every page of a Tempo list endpoint, search endpoints get the body POSTed
+
+    The next page is requested in the background while the caller processes
+    the current one, at most two pages are held in memory.
+    """
+
+    # searches only read, retrying them is safe
+    method, idempotent = ("GET", None) if body is None else ("POST", True)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = executor.submit(tempo_api_call, path, method, body, None, idempotent)
+        while page is not None:
+            response = page.result()
+            next_url = response.get("metadata", {}).get("next")
+            page = executor.submit(tempo_api_call, None, method, body, next_url, idempotent) if next_url else None
+            yield response["results"]
 
-        if "metadata" not in response or "next" not in response["metadata"]:
-            return result
 
-        next_url = response["metadata"]["next"]
+def sum_tempo_worklogs(account_ids: list, date_from: str, date_to: str) -> dict:
+    """ Return seconds worked per account id and day, searched in Tempo for many authors at once
 
+    Absence worklogs are not counted, like in sum_worklogs.
+    """
 
-def sum_worklogs(worklogs: list) -> dict:
-    """ Sum up the number of hours worked per day """
+    absence_issue_id = str(get_jira_issue_id(settings.get("jira_absence_issue")))
+    chunks = [account_ids[i:i + TEMPO_SEARCH_AUTHORS] for i in range(0, len(account_ids), TEMPO_SEARCH_AUTHORS)]
+
+    def search(chunk: list) -> dict:
+        result = defaultdict(lambda: defaultdict(int))
+        body = {"authorIds": chunk, "from": date_from, "to": date_to}
+        for records in iter_tempo_pages(f"worklogs/search?limit={TEMPO_SEARCH_PAGE_SIZE}", body):
+            for record in records:
+                if str(record["issue"]["id"]) == absence_issue_id:
+                    continue
+                result[record["author"]["accountId"]][record["startDate"]] += record["timeSpentSeconds"]
+        return result
+
+    # chunks have disjoint authors
+    sums = {}
+    for result in run_parallel(search, chunks):
+        sums.update((account_id, dict(days)) for account_id, days in result.items())
+    return sums
+
+
+def _tempo_worklog(record: dict) -> Worklog:
+    return Worklog(record["author"]["accountId"], record["startDate"], record["timeSpentSeconds"], record["issue"].get("self"))
+
+
+def sum_worklogs(worklogs) -> dict:
+    """ Sum up the number of hours worked per day, worklogs can be a stream """
 
     result = defaultdict(lambda: 0.0)
     absence_issue = settings.get("jira_absence_issue")
 
     for worklog in worklogs:
-        if worklog["issueKey"] == absence_issue:
+        if worklog.issue == absence_issue:
             continue
 
-        result[worklog["startDate"]] += worklog["timeSpentSeconds"] / 3600
+        result[worklog.date] += worklog.seconds / 3600
 
     return result
 
 
-def create_tempo_absence_worklog(
-    issue_id: str, time: int, day: str, user: str
-):
-    """ Create worklog in Tempo """
-    worklog_desc = settings.get("jira_absence_worklog_description", "Absence")
-    body = {
-        "issueId": issue_id,
+def _absence_worklog_body(time: int, day: str, user: str) -> dict:
+    return {
         "timeSpentSeconds": time,
         "billableSeconds": time,
         "startDate": day,
         "startTime": "08:00:00",
-        "description": worklog_desc,
+        "description": settings.get("jira_absence_worklog_description", "Absence"),
         "authorAccountId": user,
     }
+
+
+def create_tempo_absence_worklog(
+    issue_id: str, time: int, day: str, user: str
+):
+    """ Create worklog in Tempo """
+    body = {"issueId": issue_id, **_absence_worklog_body(time, day, user)}
     return tempo_api_call("worklogs", "POST", body)
 
+
+def create_tempo_absence_worklogs(issue_id: str, worklogs: list) -> list:
+    """ Create many absence worklogs, given as (seconds, day, account id), with a single bulk request """
+
+    body = [_absence_worklog_body(time, day, user) for time, day, user in worklogs]
+    return tempo_api_call(f"worklogs/issue/{issue_id}/bulk", "POST", body)
+
 def get_jira_issue_id(issueKey):
-    res = jira_api_call("issue/"+issueKey,"GET")
-    logging.debug("Jira API response [%s]", res['id'])
-    return res['id']
+    return _get_issue(issueKey)['id']
 
-def fetch_tempo_absences(month_start=None, month_end=None) -> dict:
-    """ Fetch absences from Tempo """
+def fetch_tempo_absences(month_start=None, month_end=None) -> Iterator[Worklog]:
+    """ Yield absence worklogs from Tempo """
 
     issue = get_jira_issue_id(settings.get("jira_absence_issue"))
     if month_start is None or month_end is None:
         month_start, month_end = get_dates_range()
     date_filter = f"from={month_start.date().isoformat()}&to={month_end.date().isoformat()}"
-    next_url = None
 
-    results = defaultdict(lambda: [])
-    while True:
-        response = tempo_api_call(f"worklogs/issue/{issue}?{date_filter}", next_url=next_url)
+    for records in iter_tempo_pages(f"worklogs/issue/{issue}?{date_filter}"):
+        yield from map(_tempo_worklog, records)
+
+
+def index_tempo_absences(worklogs) -> dict:
+    """ Index absence hours by employee email and date, worklogs can be a stream """
 
-        for record in response["results"]:
-            results[get_user_email(record["author"]["accountId"])].append({
-                "date": record["startDate"],
-                "amount": record["timeSpentSeconds"] / 3600,
-            })
+    index = defaultdict(lambda: defaultdict(lambda: []))
+    for worklog in worklogs:
+        index[get_user_email(worklog.account_id)][worklog.date].append(worklog.seconds / 3600)
+
+    return index
+
+
+def slice_tempo_absences(index: dict, email: str, period_start, period_end) -> list:
+    """ Return absence worklogs of a single employee within the given period """
 
-        # end of the pagination
-        if "metadata" not in response or "next" not in response["metadata"]:
-            return results
+    if email not in index:
+        return []
 
-        next_url = response["metadata"]["next"]
+    date_from = period_start.date().isoformat()
+    date_to = period_end.date().isoformat()
+    result = []
+    for day in sorted(index[email]):
+        if date_from <= day <= date_to:
+            result.extend({"date": day, "amount": amount} for amount in index[email][day])
+
+    return result
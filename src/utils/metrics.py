@@ -0,0 +1,211 @@
+import json
+import re
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+
+# upper bounds of latency buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+NAMESPACE = "CalamariJiraIntegration"
+
+# path segments with digits are ids (issue keys, account ids, worklog ids), short numbers are API versions
+_ID_SEGMENT = re.compile(r"\d")
+_VERSION_SEGMENT = re.compile(r"v?\d{1,2}")
+
+
+class Histogram:
+    """ Count, sum, min, max and bucket counts of observed values """
+
+    __slots__ = ("count", "sum", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "min": round(self.min or 0.0, 3),
+            "max": round(self.max or 0.0, 3),
+            "buckets": {str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.buckets) if n},
+        }
+
+
+class EndpointStats:
+    """ Requests sent to a single endpoint """
+
+    __slots__ = ("calls", "retries", "bytes", "statuses", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.bytes = 0
+        self.statuses = {}
+        self.latency = Histogram()
+
+
+_lock = threading.Lock()
+_endpoints = {}
+_phases = {}
+_employees = {}
+_cache = {}
+_started = time.monotonic()
+
+
+def reset():
+    """ Start collecting metrics of a new run """
+
+    global _started
+
+    with _lock:
+        _endpoints.clear()
+        _phases.clear()
+        _employees.clear()
+        _cache.clear()
+        _started = time.monotonic()
+
+
+def endpoint(method: str, url: str) -> str:
+    """ Return endpoint name of a request, ids in the path and the query are dropped """
+
+    segments = [
+        "{id}" if _ID_SEGMENT.search(segment) and not _VERSION_SEGMENT.fullmatch(segment) else segment
+        for segment in urllib.parse.urlsplit(url).path.split("/")
+    ]
+    return f"{method} {'/'.join(segments)}"
+
+
+def record_request(api: str, method: str, url: str, status, seconds: float, size: int, retry: bool):
+    """ Record a single HTTP request, status is the status code or the name of the connection error """
+
+    key = (api, endpoint(method, url))
+    with _lock:
+        stats = _endpoints.get(key)
+        if stats is None:
+            stats = _endpoints[key] = EndpointStats()
+        if retry:
+            stats.retries += 1
+        else:
+            stats.calls += 1
+        stats.bytes += size
+        stats.statuses[str(status)] = stats.statuses.get(str(status), 0) + 1
+        stats.latency.add(seconds)
+
+
+def record_cache(resource: str, outcome: str):
+    """ Record a lookup of a cached response, outcome is hit, stale, revalidated or miss """
+
+    with _lock:
+        outcomes = _cache.setdefault(resource, {})
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+
+@contextmanager
+def phase(name: str):
+    """ Measure wall time of a phase of a job """
+
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        with _lock:
+            _phases[name] = _phases.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def employee(email: str):
+    """ Measure wall time spent synchronizing an employee """
+
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        with _lock:
+            _employees[email] = _employees.get(email, 0.0) + elapsed
+
+
+def summary(slowest: int = 5) -> dict:
+    """ Return metrics collected since the last reset """
+
+    with _lock:
+        employees = Histogram()
+        for seconds in _employees.values():
+            employees.add(seconds)
+        return {
+            "duration": round(time.monotonic() - _started, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in _phases.items()},
+            "employee_seconds": employees.summary(),
+            "slowest_employees": {
+                email: round(seconds, 3)
+                for email, seconds in sorted(_employees.items(), key=lambda item: -item[1])[:slowest]
+            },
+            "endpoints": {
+                f"{api} {name}": {
+                    "calls": stats.calls,
+                    "retries": stats.retries,
+                    "bytes": stats.bytes,
+                    "statuses": dict(stats.statuses),
+                    "latency": stats.latency.summary(),
+                }
+                for (api, name), stats in _endpoints.items()
+            },
+            "cache": {resource: dict(outcomes) for resource, outcomes in _cache.items()},
+        }
+
+
+def emit(job: str, shard: tuple|None = None):
+    """ Print run summary as a CloudWatch embedded metric format (EMF) line
+
+    Totals are metrics with the job as dimension, the per endpoint and per
+    phase details are properties of the same line, searchable in Logs Insights.
+    """
+
+    data = summary()
+    endpoints = data["endpoints"].values()
+    metrics = {
+        "Duration": (data["duration"], "Seconds"),
+        "ApiCalls": (sum(e["calls"] for e in endpoints), "Count"),
+        "ApiRetries": (sum(e["retries"] for e in endpoints), "Count"),
+        "ApiBytes": (sum(e["bytes"] for e in endpoints), "Bytes"),
+        "ApiLatency": (round(sum(e["latency"]["sum"] for e in endpoints), 3), "Seconds"),
+        "Employees": (data["employee_seconds"]["count"], "Count"),
+        # stale responses are served from the cache too, revalidated ones cost a request without a body
+        "CacheHits": (sum(o.get("hit", 0) + o.get("stale", 0) for o in data["cache"].values()), "Count"),
+        "CacheRevalidations": (sum(o.get("revalidated", 0) for o in data["cache"].values()), "Count"),
+        "CacheMisses": (sum(o.get("miss", 0) for o in data["cache"].values()), "Count"),
+    }
+
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": NAMESPACE,
+                "Dimensions": [["Job"]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        "Job": job,
+        "Shard": None if shard is None else f"{shard[0]}/{shard[1]}",
+        **{name: value for name, (value, _) in metrics.items()},
+        **{key: value for key, value in data.items() if key != "duration"},
+    }
+    # printed rather than logged, EMF lines must not carry the log record prefix
+    print(json.dumps(line), flush=True)
@@ -0,0 +1,75 @@
+import logging
+from collections import defaultdict
+from typing import NamedTuple
+
+import src.utils.calamari as calamari
+import src.utils.settings as settings
+from src.utils.concurrency import run_parallel
+
+
+class Operation(NamedTuple):
+    """ Single change of a Calamari timesheet """
+
+    action: str  # create, update or delete
+    employee: str
+    day: str
+    hours: float|None = None
+    entry_id: int|None = None
+
+
+def plan_timesheet(employee_email: str, jira_sum: dict, calamari_timesheet: list) -> list:
+    """ Return operations making the Calamari timesheet match Jira sums (hours per day) """
+
+    entries_by_day = defaultdict(lambda: [])
+    for entry in calamari_timesheet:
+        entries_by_day[entry["started"][0:10]].append(entry)
+
+    operations = []
+    for day in sorted(set(jira_sum) | set(entries_by_day)):
+        hours = jira_sum.get(day, 0.0)
+        entries = entries_by_day.get(day, [])
+        # compared in whole seconds, sums of hour fractions are rarely exact
+        seconds = round(hours * 3600)
+        calamari_seconds = round(sum(entry["duration"] for entry in entries))
+
+        if seconds == calamari_seconds:
+            logging.info("Calamari timesheet for %s is in sync with Jira worklogs on day %s", employee_email, day)
+            continue
+
+        if seconds == 0:
+            operations.extend(Operation("delete", employee_email, day, entry_id=int(e["id"])) for e in entries)
+        elif not entries:
+            operations.append(Operation("create", employee_email, day, hours))
+        else:
+            # reuse the first entry of the day and drop the others
+            operations.append(Operation("update", employee_email, day, hours, int(entries[0]["id"])))
+            operations.extend(Operation("delete", employee_email, day, entry_id=int(e["id"])) for e in entries[1:])
+
+    return operations
+
+
+def is_dry_run() -> bool:
+    return settings.load().dry_run
+
+
+def apply(operations: list):
+    """ Apply timesheet operations concurrently, only log them in dry-run mode """
+
+    if is_dry_run():
+        for op in operations:
+            logging.info("[dry-run] %s timesheet entry for %s on day %s (hours %s, entry %s)", op.action, op.employee, op.day, op.hours, op.entry_id)
+        return
+
+    run_parallel(_apply_operation, operations)
+
+
+def _apply_operation(op: Operation):
+    if op.action == "create":
+        logging.info("Creating timesheet entry for %s on day %s (hours %s)", op.employee, op.day, op.hours)
+        calamari.create_timesheet(op.employee, op.day, op.hours)
+    elif op.action == "update":
+        logging.info("Updating timesheet entry for %s on day %s (hours %s)", op.employee, op.day, op.hours)
+        calamari.update_timesheet(op.entry_id, op.day, op.hours)
+    elif op.action == "delete":
+        logging.info("Deleting timesheet entry for %s on day %s", op.employee, op.day)
+        calamari.delete_timesheet(op.entry_id)
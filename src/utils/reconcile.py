@@ -0,0 +1,88 @@
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+import src.utils.settings as settings
+
+
+class AbsenceWorklog(NamedTuple):
+    """ Absence worklog of an employee, also its idempotency key """
+
+    employee: str
+    day: str
+    seconds: int
+
+    def as_conflict(self) -> dict:
+        """ Return the worklog as reported in conflicts """
+
+        return {"date": self.day, "amount": self.seconds / 3600}
+
+
+class AbsenceDiff(NamedTuple):
+    """ Difference between absence days of an employee and their absence worklogs """
+
+    missing: list  # absence days without a worklog, to be created
+    extra: list  # worklogs without an absence day, reported as conflicts
+
+    @property
+    def in_sync(self) -> bool:
+        return not self.missing and not self.extra
+
+
+def diff_absences(employee: str, absences: list, worklogs: list, tolerance: int|None = None) -> AbsenceDiff:
+    """ Compare absence days with absence worklogs, both given as {"date", "amount" (hours)}
+
+    Both sides are counted by (date, seconds), so the order doesn't matter and
+    repeated amounts on the same day match one to one. Amounts of the same day
+    differing by at most tolerance seconds match as well.
+    """
+
+    if tolerance is None:
+        tolerance = settings.load().absence_match_tolerance
+
+    expected = Counter((absence["date"], _seconds(absence["amount"])) for absence in absences)
+    actual = Counter((worklog["date"], _seconds(worklog["amount"])) for worklog in worklogs)
+    missing = expected - actual
+    extra = actual - expected
+    if tolerance > 0 and missing and extra:
+        missing, extra = _match_within(missing, extra, tolerance)
+
+    return AbsenceDiff(
+        missing=[AbsenceWorklog(employee, day, seconds) for day, seconds in sorted(missing.elements())],
+        extra=[AbsenceWorklog(employee, day, seconds) for day, seconds in sorted(extra.elements())],
+    )
+
+
+def _seconds(hours: float) -> int:
+    return round(hours * 3600)
+
+
+def _match_within(missing: Counter, extra: Counter, tolerance: int) -> tuple:
+    """ Drop pairs of missing and extra amounts of the same day within tolerance, return what is left """
+
+    extra_by_day = defaultdict(list)
+    for day, seconds in extra.elements():
+        extra_by_day[day].append(seconds)
+
+    left_missing, left_extra = Counter(), Counter()
+    missing_by_day = defaultdict(list)
+    for day, seconds in missing.elements():
+        missing_by_day[day].append(seconds)
+
+    for day in missing_by_day.keys() | extra_by_day.keys():
+        # both sides sorted, the closest amounts are paired greedily
+        wanted, logged = sorted(missing_by_day.get(day, [])), sorted(extra_by_day.get(day, []))
+        i = j = 0
+        while i < len(wanted) and j < len(logged):
+            if abs(wanted[i] - logged[j]) <= tolerance:
+                i += 1
+                j += 1
+            elif wanted[i] < logged[j]:
+                left_missing[day, wanted[i]] += 1
+                i += 1
+            else:
+                left_extra[day, logged[j]] += 1
+                j += 1
+        left_missing.update((day, seconds) for seconds in wanted[i:])
+        left_extra.update((day, seconds) for seconds in logged[j:])
+
+    return left_missing, left_extra
@@ -0,0 +1,199 @@
+import csv
+import html
+import json
+import logging
+import os
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+
+import src.utils.aws as aws
+import src.utils.settings as settings
+
+# conflicts inlined into the follow-up invocation, Lambda limits asynchronous payloads to 256 KB
+MAX_EVENT_BYTES = 200_000
+# larger HTML reports are linked from the email instead of being its body
+MAX_EMAIL_BYTES = 1_000_000
+# lifetime of the link to a large report (the longest S3 allows)
+LINK_EXPIRES = 7 * 24 * 3600
+
+_threads = []
+
+HTML_HEAD = """<html>
+<head>
+<style>
+.g-table { border: solid 3px #DDEEEE; border-collapse: collapse; border-spacing: 0; font: normal 14px Roboto, sans-serif; }
+.g-table th { background-color: #DDEFEF; border: solid 1px #DDEEEE; color: #336B5B; min-width: 72px; padding: 10px; text-align: left; text-shadow: 1px 1px 1px #fff; }
+.g-table td { border: solid 1px #DDEEEE; color: #333; padding: 10px; }
+</style>
+</head>
+<body>
+<h3>Absence worklog conflicts</h3>
+"""
+
+
+def submit(job: str, conflicts: dict, function_name: str|None = None):
+    """ Hand the conflicts over to the report stage without waiting for it
+
+    The conflicts are streamed to REPORT_LOCATION as JSON lines, the report
+    is rendered and delivered by a follow-up asynchronous invocation of the
+    function, which gets only a pointer to them. Conflicts stored in the
+    container's temp directory are inlined into the event instead, when
+    they fit. Local runs deliver the report in a background thread, see wait().
+    """
+
+    if not (settings.get("notification_emails") or settings.get("report_location")) or len(conflicts) == 0:
+        return
+
+    path = _write_conflicts(job, conflicts)
+    event = {"job": "send-report", "source": job, "conflicts": _store(path)}
+
+    if function_name is None:
+        # local runs have no follow-up invocation
+        thread = threading.Thread(target=_deliver_safely, args=(job, event["conflicts"]), name="report")
+        thread.start()
+        _threads.append(thread)
+        return
+
+    if not event["conflicts"].startswith("s3://"):
+        # another container can't read this one's temp directory
+        if os.path.getsize(path) > MAX_EVENT_BYTES:
+            logging.warning("Conflicts of %s are too large for an event, delivering the report in this invocation, set REPORT_LOCATION to an s3:// URL to avoid it", job)
+            deliver(job, event["conflicts"])
+            return
+        with open(path) as f:
+            event["conflicts"], event["inline"] = f.read(), True
+
+    try:
+        aws.invoke_async(function_name, json.dumps(event))
+    except Exception as e:
+        logging.warning("Can't hand the %s report over to a follow-up invocation, delivering it in this one: %s", job, e)
+        deliver(job, event["conflicts"], event.get("inline", False))
+
+
+def wait():
+    """ Wait for reports delivered in the background """
+
+    while _threads:
+        _threads.pop().join()
+
+
+def _deliver_safely(job: str, conflicts: str):
+    try:
+        deliver(job, conflicts)
+    except Exception:
+        logging.exception("Report of %s failed", job)
+
+
+def deliver(job: str, conflicts: str, inline: bool = False):
+    """ Render the report of conflicts stored by submit, store it and email it to NOTIFICATION_EMAILS
+
+    conflicts is the location of the JSON lines, or the lines themselves when inline.
+    """
+
+    rows = (json.loads(line) for line in _read_lines(conflicts, inline) if line.strip())
+    paths, employees, count = _render(job, rows)
+    html_location = _store(paths["html"])
+    _store(paths["csv"])
+
+    addresses = [address.strip() for address in (settings.get("notification_emails") or "").split(",") if address.strip()]
+    if not addresses:
+        return
+
+    if os.path.getsize(paths["html"]) <= MAX_EMAIL_BYTES:
+        with open(paths["html"]) as f:
+            message = f.read()
+    else:
+        summary = f"{count} conflicting worklogs of {employees} employees, the report is too large for an email."
+        url = urllib.parse.urlsplit(html_location)
+        if url.scheme == "s3":
+            link = aws.presigned_url(url.netloc, url.path.lstrip("/"), LINK_EXPIRES)
+            summary += f' <a href="{html.escape(link)}">Download it</a> (the link expires in 7 days).'
+        else:
+            summary += " Set REPORT_LOCATION to an s3:// URL to get a download link."
+        message = f"{HTML_HEAD}<p>{summary}</p></body></html>"
+    aws.send_email("Absence sync report", message, addresses)
+
+
+def _report_path(job: str, ext: str, stamp: str) -> str:
+    # reports uploaded to S3 are written to the temp directory first
+    location = settings.get("report_location")
+    directory = location if location and not location.startswith("s3://") else os.path.join(tempfile.gettempdir(), "calamari-jira-reports")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{job}-{stamp}.{ext}")
+
+
+def _stamp() -> str:
+    # several runs (shards, retries) can finish within the same second
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')}-{uuid.uuid4().hex[:8]}"
+
+
+def _write_conflicts(job: str, conflicts: dict) -> str:
+    """ Stream conflicts to a JSON lines file, one conflicting worklog per line """
+
+    path = _report_path(job, "jsonl", _stamp())
+    with open(path, "w") as f:
+        for email in sorted(conflicts):
+            for worklog in conflicts[email]:
+                f.write(json.dumps({"employee": email, **worklog}) + "\n")
+    return path
+
+
+def _read_lines(conflicts: str, inline: bool):
+    if inline:
+        yield from conflicts.splitlines()
+        return
+
+    url = urllib.parse.urlsplit(conflicts)
+    if url.scheme == "s3":
+        yield from aws.read_lines(url.netloc, url.path.lstrip("/"))
+        return
+
+    with open(conflicts) as f:
+        yield from f
+
+
+def _render(job: str, rows) -> tuple:
+    """ Write HTML and CSV reports in a single pass over the rows, return their paths, employees and rows
+
+    Rows are streamed to both files as they are read, the whole report is
+    never held in memory.
+    """
+
+    stamp = _stamp()
+    paths = {ext: _report_path(job, ext, stamp) for ext in ("html", "csv")}
+    employees = set()
+    count = 0
+
+    with open(paths["html"], "w") as html_file, open(paths["csv"], "w", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["employee", "date", "amount", "error"])
+        html_file.write(HTML_HEAD)
+        html_file.write('<table class="g-table">\n<tr><th>Employee</th><th>Date</th><th>Amount</th><th>Error</th></tr>\n')
+
+        for row in rows:
+            html_file.write(f"<tr><td>{html.escape(row['employee'])}</td><td>{html.escape(str(row['date']))}</td><td>{row['amount']}</td><td>{html.escape(row.get('error', ''))}</td></tr>\n")
+            csv_writer.writerow([row["employee"], row["date"], row["amount"], row.get("error", "")])
+            employees.add(row["employee"])
+            count += 1
+
+        html_file.write("</table>\n</body></html>\n")
+
+    return paths, len(employees), count
+
+
+def _store(path: str) -> str:
+    """ Upload a report file to REPORT_LOCATION if it is an S3 URL, return where the file is """
+
+    url = urllib.parse.urlsplit(settings.get("report_location") or "")
+    if url.scheme != "s3":
+        logging.info("Report written to %s", path)
+        return path
+
+    prefix = url.path.strip("/")
+    key = f"{prefix}/{os.path.basename(path)}" if prefix else os.path.basename(path)
+    aws.upload_file(path, url.netloc, key)
+    logging.info("Report uploaded to s3://%s/%s", url.netloc, key)
+    return f"s3://{url.netloc}/{key}"
@@ -1,22 +1,116 @@
 import os
+from dataclasses import dataclass
 from functools import cache
 
-import boto3
 import logging
 
-ssm = boto3.client("ssm")
 
 @cache
 def get(key: str, default: str|None = None) -> str|None:
     if os.getenv("SETTINGS_STORE") == "ssm_parameters":
-        ssm_prefix = os.getenv("SSM_PARAMETERSTORE_PREFIX")
-        return _get_ssm_parameter(ssm_prefix+"/"+key.upper(), default)
+        return _get_ssm_parameters().get(key.upper(), default)
     return os.getenv(key.upper(), default)
 
 
 @cache
-def _get_ssm_parameter(name: str, default: str|None) -> str|None:
+def _get_ssm_parameters() -> dict:
+    """ Load all parameters stored under SSM_PARAMETERSTORE_PREFIX at once """
+
+    # aws imports settings, it is imported only by deployments using SSM
+    import src.utils.aws as aws
+
+    ssm_prefix = os.getenv("SSM_PARAMETERSTORE_PREFIX").rstrip("/")
+    parameters = {
+        name[len(ssm_prefix) + 1:].upper(): value
+        for name, value in aws.get_parameters_by_path(ssm_prefix).items()
+    }
+
+    logging.debug("Loaded %d settings from SSM Parameter Store", len(parameters))
+    return parameters
+
+
+@dataclass(frozen=True)
+class Settings:
+    """ Parsed and validated settings which are not plain strings """
+
+    calamari_absence_ignored_employees: tuple
+    calamari_absence_ignored_types: tuple
+    calamari_timesheet_contract_types: tuple
+    days_before: int
+    days_after: int
+    debug: bool
+    dry_run: bool
+    sync_workers: int
+    sync_full_reconciliation_hours: int
+    calamari_batch_size: int
+    calamari_holiday_cache_ttl: float
+    absence_match_tolerance: int
+    jira_user_directory_ttl: float
+    calamari_employees_cache_ttl: float
+    calamari_workweeks_cache_ttl: float
+    jira_issue_cache_ttl: float
+    http_cache_stale: float
+    http_pool_size: int
+    http_max_retries: int
+    http_backoff: float
+    http_timeout: float
+    http_max_retry_after: float
+    jira_rate_limit: float
+    tempo_rate_limit: float
+    calamari_rate_limit: float
+    http_trace_apis: tuple
+    http_trace_sample_rate: float
+    http_trace_max_bytes: int
+
+
+def _parse(key: str, default: str, parser):
+    value = get(key, default)
     try:
-        return ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"]
-    except ssm.exceptions.ParameterNotFound:
-        return default
+        return parser(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value {value!r} of setting {key.upper()}") from None
+
+
+def _list(value: str|None) -> tuple:
+    return tuple(item.strip() for item in (value or "").split(",") if item.strip())
+
+
+def _bool(value: str) -> bool:
+    return bool(int(value))
+
+
+@cache
+def load() -> Settings:
+    """ Return typed settings, parsed once for the lifetime of the container """
+
+    return Settings(
+        calamari_absence_ignored_employees=_parse("calamari_absence_ignored_employees", "", _list),
+        calamari_absence_ignored_types=_parse("calamari_absence_ignored_types", "", _list),
+        calamari_timesheet_contract_types=_parse("calamari_timesheet_contract_types", "", _list),
+        # 90 days is our default max value
+        days_before=min(_parse("days_before", "30", int), 90),
+        days_after=min(_parse("days_after", "30", int), 90),
+        debug=_parse("debug", "0", _bool),
+        dry_run=_parse("dry_run", "0", _bool),
+        sync_workers=_parse("sync_workers", "8", int),
+        sync_full_reconciliation_hours=_parse("sync_full_reconciliation_hours", "168", int),
+        calamari_batch_size=_parse("calamari_batch_size", "50", int),
+        calamari_holiday_cache_ttl=_parse("calamari_holiday_cache_ttl", "86400", float),
+        absence_match_tolerance=_parse("absence_match_tolerance", "0", int),
+        jira_user_directory_ttl=_parse("jira_user_directory_ttl", "3600", float),
+        calamari_employees_cache_ttl=_parse("calamari_employees_cache_ttl", "300", float),
+        calamari_workweeks_cache_ttl=_parse("calamari_workweeks_cache_ttl", "3600", float),
+        jira_issue_cache_ttl=_parse("jira_issue_cache_ttl", "86400", float),
+        http_cache_stale=_parse("http_cache_stale", "3600", float),
+        http_pool_size=_parse("http_pool_size", "10", int),
+        http_max_retries=_parse("http_max_retries", "5", int),
+        http_backoff=_parse("http_backoff", "0.5", float),
+        http_timeout=_parse("http_timeout", "30", float),
+        http_max_retry_after=_parse("http_max_retry_after", "60", float),
+        jira_rate_limit=_parse("jira_rate_limit", "10", float),
+        tempo_rate_limit=_parse("tempo_rate_limit", "5", float),
+        calamari_rate_limit=_parse("calamari_rate_limit", "5", float),
+        http_trace_apis=_parse("http_trace_apis", "calamari,jira,tempo", _list),
+        http_trace_sample_rate=_parse("http_trace_sample_rate", "1", float),
+        http_trace_max_bytes=_parse("http_trace_max_bytes", "2048", int),
+    )
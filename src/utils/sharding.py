@@ -0,0 +1,87 @@
+import json
+import logging
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+def shard_of(email: str, of: int) -> int:
+    """ Return stable shard number of an employee, independent of the order of the employee list """
+
+    return zlib.crc32(email.lower().encode()) % of
+
+
+def select(employees, shard: int, of: int) -> tuple:
+    """ Return employees belonging to the shard """
+
+    return tuple(employee for employee in employees if shard_of(employee.email, of) == shard)
+
+
+def partition(shard: tuple|None) -> str|None:
+    """ Return name of the state partition of a shard, shards never write the same state document """
+
+    if shard is None:
+        return None
+    return f"shard-{shard[0]}-of-{shard[1]}"
+
+
+def fan_out(job: str, of: int, invoke) -> dict:
+    """ Dispatch the job as one event per shard and merge the reports of all shards
+
+    All shards run at the same time, invoke is called concurrently and
+    returns the report of a shard.
+    """
+
+    events = [{"job": job, "shard": shard, "of": of} for shard in range(of)]
+    with ThreadPoolExecutor(max_workers=of) as executor:
+        reports = list(executor.map(lambda event: _dispatch(invoke, event), events))
+    return merge_reports(events, reports)
+
+
+def _dispatch(invoke, event: dict) -> dict|None:
+    try:
+        return invoke(event)
+    except Exception:
+        logging.exception("Shard %s/%s of %s failed", event["shard"], event["of"], event["job"])
+        return None
+
+
+def merge_reports(events: list, reports: list) -> dict:
+    """ Merge conflict reports of shards, shards without a report are listed as failed """
+
+    conflicts = {}
+    failed = []
+    for event, report in zip(events, reports):
+        if report is None:
+            failed.append(event["shard"])
+            continue
+        conflicts.update(report.get("conflicts", {}))
+
+    if failed:
+        logging.error("Shards %s of %s did not report", failed, events[0]["job"])
+    if len(conflicts) == 0:
+        logging.info("No conflicts in worklogs detected in any shard.")
+    else:
+        logging.warning("Conflicting worklogs detected: %s", conflicts)
+    return {"conflicts": conflicts, "failed_shards": failed}
+
+
+def local_invoker(handler):
+    """ Run shards in this process, for local runs and testing without AWS """
+
+    return lambda event: handler(event, None)
+
+
+def lambda_invoker(function_name: str, timeout: float):
+    """ Run shards as synchronous invocations of the Lambda function, waiting at most timeout seconds """
+
+    import src.utils.aws as aws
+
+    def invoke(event: dict) -> dict:
+        # never retried, a retried invocation would synchronize the shard twice
+        res = aws.invoke(function_name, json.dumps(event), timeout)
+        payload = json.loads(res["Payload"].read() or b"null")
+        if "FunctionError" in res:
+            raise RuntimeError(f"Shard invocation failed: {payload}")
+        return payload
+
+    return invoke
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+from abc import ABC, abstractmethod
+
+import src.utils.aws as aws
+import src.utils.settings as settings
+
+
+class DocumentStore(ABC):
+    """ Keeps the whole state in a single JSON document, read once and written on flush """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.document = None
+        self.dirty = False
+
+    def load(self, key: str) -> dict|None:
+        with self.lock:
+            if self.document is None:
+                self.document = self._read()
+            return self.document.get(key)
+
+    def save(self, key: str, value: dict):
+        with self.lock:
+            if self.document is None:
+                self.document = self._read()
+            self.document[key] = value
+            self.dirty = True
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self._write(self.document)
+                self.dirty = False
+
+    @abstractmethod
+    def _read(self) -> dict:
+        pass
+
+    @abstractmethod
+    def _write(self, document: dict):
+        pass
+
+
+class JsonFileStore(DocumentStore):
+    """ State kept in a local JSON file """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, document: dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(document, f)
+        os.replace(tmp_path, self.path)
+
+
+class S3Store(DocumentStore):
+    """ State kept in a single S3 object """
+
+    def __init__(self, bucket: str, key: str):
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+
+    def _read(self) -> dict:
+        body = aws.read_object(self.bucket, self.key)
+        return {} if body is None else json.loads(body)
+
+    def _write(self, document: dict):
+        aws.write_object(self.bucket, self.key, json.dumps(document).encode())
+
+
+class SqliteStore:
+    """ State kept in a local SQLite database, one row per key """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def load(self, key: str) -> dict|None:
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, key: str, value: dict):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def flush(self):
+        with self.lock:
+            self.db.commit()
+
+
+def get_store(partition: str|None = None):
+    """ Return the sync state store configured by SYNC_STATE_STORE, None if not configured
+
+    Supported values: file:///path/state.json, sqlite:///path/state.db, s3://bucket/key.json
+    A partition (sharded runs) gets its own state file or object. Every run
+    gets a new store, a warm container must not keep a document another
+    container has written since.
+    """
+
+    location = settings.get("sync_state_store")
+    if not location:
+        return None
+
+    url = urllib.parse.urlsplit(location)
+    if url.scheme == "file":
+        return JsonFileStore(_partitioned(url.path, partition))
+    if url.scheme == "sqlite":
+        return SqliteStore(_partitioned(url.path, partition))
+    if url.scheme == "s3":
+        return S3Store(url.netloc, _partitioned(url.path.lstrip("/"), partition))
+
+    logging.error("Unsupported sync state store %s, running without state", location)
+    return None
+
+
+def _partitioned(path: str, partition: str|None) -> str:
+    if partition is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{partition}{ext}"
+
+
+def day_hash(jira_seconds: int, calamari_seconds: int) -> str:
+    """ Content hash of a single day of a timesheet """
+
+    return hashlib.sha1(f"{jira_seconds}:{calamari_seconds}".encode()).hexdigest()[:16]
@@ -0,0 +1,197 @@
+import email.utils
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import src.utils.metrics as metrics
+import src.utils.settings as settings
+from src.utils.concurrency import locked_cache
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+SENSITIVE_HEADERS = ("authorization", "proxy-authorization", "cookie", "set-cookie")
+
+
+class TokenBucket:
+    """ Thread-safe token bucket limiting the number of requests per second """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """ Take a token, return how many seconds to wait before sending the request """
+
+        if self.rate <= 0:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # tokens can go below zero, later callers queue up behind earlier ones
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self):
+        """ Block until a request can be sent """
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+@locked_cache
+def get_bucket(name: str) -> TokenBucket:
+    """ Return rate limiter of an API, shared by all threads """
+
+    rate = getattr(settings.load(), f"{name}_rate_limit")
+    return TokenBucket(rate, max(rate, 1))
+
+
+class ApiClient:
+    """ Pooled HTTP session with retries and rate limiting for a single API """
+
+    def __init__(self, name: str, pool_size: int, max_retries: int, backoff: float, timeout: float):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = get_bucket(name)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retry_delay(self, method: str, idempotent: bool|None, attempt: int, res=None, error: Exception|None = None) -> float|None:
+        """ Return delay before the next attempt, None if the request should not be retried
+
+        429 responses are always retried, as the request was not processed.
+        5xx responses and connection errors are only retried for idempotent
+        requests, so that a write is never sent twice.
+        """
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if attempt >= self.max_retries:
+            return None
+
+        if error is not None:
+            if not idempotent:
+                return None
+            delay = self.backoff * (2 ** attempt)
+            logging.warning("%s API request failed (%s), retrying in %.1fs", self.name, error, delay)
+            return delay
+
+        if res.status_code not in RETRY_STATUSES:
+            return None
+        if res.status_code != 429 and not idempotent:
+            return None
+        delay = _retry_after(res)
+        if delay is None:
+            delay = self.backoff * (2 ** attempt)
+        logging.warning("%s API returned %s, retrying in %.1fs", self.name, res.status_code, delay)
+        return delay
+
+    def request(self, method: str, url: str, idempotent: bool|None = None, **kwargs) -> requests.Response:
+        """ Send a request, retrying on 429, 5xx and connection errors """
+
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            started = time.monotonic()
+            try:
+                res = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.record_request(self.name, method, url, type(e).__name__, time.monotonic() - started, 0, attempt > 0)
+                delay = self._retry_delay(method, idempotent, attempt, error=e)
+                if delay is None:
+                    raise
+            else:
+                metrics.record_request(self.name, method, url, res.status_code, time.monotonic() - started, len(res.content), attempt > 0)
+                if _tracing(self.name):
+                    _trace(self.name, method, url, kwargs, res)
+                delay = self._retry_delay(method, idempotent, attempt, res=res)
+                if delay is None:
+                    return res
+
+            time.sleep(delay)
+            attempt += 1
+
+
+def _tracing(name: str) -> bool:
+    """ Decide whether to trace a request, cheap enough to be called for every request """
+
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return False
+    config = settings.load()
+    return name in config.http_trace_apis and random.random() < config.http_trace_sample_rate
+
+
+def _trace(name: str, method: str, url: str, kwargs: dict, res):
+    """ Log request and response as a single JSON line, bodies capped and credentials redacted """
+
+    limit = settings.load().http_trace_max_bytes
+    body = kwargs.get("json")
+    request_body = json.dumps(body) if body is not None else ""
+    logging.debug("%s API trace: %s", name, json.dumps({
+        "method": method,
+        "url": url,
+        "status": res.status_code,
+        "request_headers": _redact(kwargs.get("headers") or {}),
+        "request_body": request_body[:limit],
+        "request_bytes": len(request_body),
+        "response_headers": _redact(res.headers),
+        "response_body": res.content[:limit].decode(errors="replace"),
+        "response_bytes": len(res.content),
+    }))
+
+
+def _redact(headers) -> dict:
+    return {
+        key: "***" if key.lower() in SENSITIVE_HEADERS or "token" in key.lower() else value
+        for key, value in headers.items()
+    }
+
+
+def _retry_after(res) -> float|None:
+    """ Parse Retry-After header (seconds or HTTP date) """
+
+    value = res.headers.get("Retry-After")
+    if value is None:
+        return None
+
+    max_delay = settings.load().http_max_retry_after
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = retry_at.timestamp() - time.time()
+
+    return min(max(delay, 0.0), max_delay)
+
+
+@locked_cache
+def get_client(name: str) -> ApiClient:
+    """ Return shared HTTP client for the given API (jira, tempo or calamari) """
+
+    config = settings.load()
+    return ApiClient(
+        name,
+        pool_size=config.http_pool_size,
+        max_retries=config.http_max_retries,
+        backoff=config.http_backoff,
+        timeout=config.http_timeout,
+    )
@@ -0,0 +1,40 @@
+import datetime as dt
+
+WEEKDAYS = ("MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY")
+
+
+class WorkCalendar:
+    """ Working hours per weekday and holidays of an employee, compiled from Calamari workweek """
+
+    __slots__ = ("hours", "holidays", "average_hours")
+
+    def __init__(self, workweek: dict, holidays):
+        # None marks weekdays missing in the workweek configuration
+        hours = [None] * 7
+        duration_sum = 0.0
+        duration_days = 0
+        for workday in workweek['workingDays']:
+            weekday = WEEKDAYS.index(workday['dayName']) if workday['dayName'] in WEEKDAYS else None
+            if weekday is not None and hours[weekday] is None:
+                hours[weekday] = float(workday['duration']/60/60) if workday['duration'] else 0.0
+            if workday['duration']:
+                duration_sum += workday['duration']
+                duration_days += 1
+
+        self.hours = tuple(hours)
+        self.holidays = frozenset(holidays)
+        self.average_hours = duration_sum/duration_days/60/60 if duration_sum and duration_days else None
+
+    def expand(self, start: dt.date, end: dt.date) -> list:
+        """ Return (date, ISO date, working hours, is holiday) for every day between start and end """
+
+        days = []
+        date = start
+        one_day = dt.timedelta(days=1)
+        weekday = start.weekday()
+        while date <= end:
+            day = date.isoformat()
+            days.append((date, day, self.hours[weekday], day in self.holidays))
+            date += one_day
+            weekday = (weekday + 1) % 7
+        return days
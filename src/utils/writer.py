@@ -0,0 +1,129 @@
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import NamedTuple
+
+import requests
+
+import src.utils.jira as jira
+import src.utils.settings as settings
+from src.utils.reconcile import AbsenceWorklog
+from src.utils.concurrency import run_parallel
+
+# absence worklogs per bulk request
+TEMPO_BULK_SIZE = 50
+
+# statuses of a Tempo instance without the bulk endpoint
+_BULK_UNAVAILABLE = (404, 405)
+
+_bulk_available = True
+
+
+class Failure(NamedTuple):
+    """ Absence worklog which could not be created """
+
+    worklog: AbsenceWorklog
+    error: str
+
+
+def create_absence_worklogs(issue_id: str, missing: list, absence_index: dict) -> list:
+    """ Create missing absence worklogs of the run, return failures per worklog
+
+    Worklogs are sent in bulk requests, or as single requests in parallel
+    where the bulk endpoint is not available. A worklog is sent again only
+    after Tempo was checked not to have it, absence_index holds the absence
+    worklogs the missing ones were planned against. Failures are logged and
+    returned, they never abort the run.
+    """
+
+    pending = Counter(missing)
+    if not pending:
+        return []
+
+    if settings.load().dry_run:
+        for worklog, count in sorted(pending.items()):
+            logging.info("[dry-run] create %d absence worklog(s) for %s on day %s (hours %s)", count, worklog.employee, worklog.day, worklog.seconds / 3600)
+        return []
+
+    # account ids are resolved once per employee, not once per missing day
+    accounts = {employee: jira.get_account_id(employee) for employee in {worklog.employee for worklog in pending}}
+    failures = [
+        Failure(worklog, "User not found in Jira")
+        for worklog in pending.elements() if accounts[worklog.employee] is None
+    ]
+    entries = [worklog for worklog in pending.elements() if accounts[worklog.employee] is not None]
+
+    if _bulk_available:
+        chunks = [entries[i:i + TEMPO_BULK_SIZE] for i in range(0, len(entries), TEMPO_BULK_SIZE)]
+        created = run_parallel(lambda chunk: _create_bulk(issue_id, chunk, accounts), chunks)
+        # a failed bulk request may have created a part of the worklogs
+        failed = [worklog for chunk, ok in zip(chunks, created) if ok is False for worklog in chunk]
+        entries = [worklog for chunk, ok in zip(chunks, created) if ok is None for worklog in chunk]
+        if failed:
+            try:
+                entries.extend(_still_missing(failed, absence_index))
+            except requests.RequestException as e:
+                # without knowing what was created, sending the worklogs again could duplicate them
+                failures.extend(Failure(worklog, f"Bulk creation failed and could not be verified: {e}") for worklog in failed)
+
+    results = run_parallel(lambda worklog: _create_single(issue_id, worklog, accounts[worklog.employee]), entries)
+    failures.extend(failure for failure in results if failure is not None)
+
+    for failure in failures:
+        logging.error("Absence worklog of %s on day %s (hours %s) not created: %s", failure.worklog.employee, failure.worklog.day, failure.worklog.seconds / 3600, failure.error)
+    return failures
+
+
+def _create_bulk(issue_id: str, chunk: list, accounts: dict) -> bool|None:
+    """ Create a chunk of worklogs, return False if the request failed, None if nothing was sent or created """
+
+    global _bulk_available
+
+    if not _bulk_available:
+        return None
+    try:
+        jira.create_tempo_absence_worklogs(issue_id, [(w.seconds, w.day, accounts[w.employee]) for w in chunk])
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in _BULK_UNAVAILABLE:
+            logging.info("Tempo bulk worklog creation is not available, creating worklogs one by one")
+            _bulk_available = False
+            return None
+        logging.warning("Bulk creation of %d absence worklogs failed: %s", len(chunk), e)
+        return False
+    except requests.RequestException as e:
+        logging.warning("Bulk creation of %d absence worklogs failed: %s", len(chunk), e)
+        return False
+
+    for worklog in chunk:
+        logging.info("Created absence worklog of %s on day %s (hours %s)", worklog.employee, worklog.day, worklog.seconds / 3600)
+    return True
+
+
+def _create_single(issue_id: str, worklog: AbsenceWorklog, account_id: str) -> Failure|None:
+    try:
+        jira.create_tempo_absence_worklog(issue_id, worklog.seconds, worklog.day, account_id)
+    except requests.RequestException as e:
+        return Failure(worklog, str(e))
+
+    logging.info("Created absence worklog of %s on day %s (hours %s)", worklog.employee, worklog.day, worklog.seconds / 3600)
+    return None
+
+
+def _still_missing(entries: list, absence_index: dict) -> list:
+    """ Return entries Tempo still doesn't have, compared by (employee, day, seconds) """
+
+    days = sorted(worklog.day for worklog in entries)
+    current = jira.index_tempo_absences(jira.fetch_tempo_absences(
+        datetime.strptime(days[0], "%Y-%m-%d"),
+        datetime.strptime(days[-1], "%Y-%m-%d"),
+    ))
+
+    result = []
+    for worklog, count in Counter(entries).items():
+        hours = worklog.seconds / 3600
+        created = (
+            current.get(worklog.employee, {}).get(worklog.day, []).count(hours)
+            - absence_index.get(worklog.employee, {}).get(worklog.day, []).count(hours)
+        )
+        result.extend([worklog] * max(count - max(created, 0), 0))
+    return result